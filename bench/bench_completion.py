@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017-2020 Fabrice Laporte - kray.me
+# The MIT License http://www.opensource.org/licenses/mit-license.php
+
+"""Measure time taken to compute completion suggestions of payees of
+increasing number of words, as when prompting for a match.
+
+Usage: python bench/bench_completion.py [RUNS]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from qifqif import ui  # noqa: E402
+
+WORDS = (
+    u"SEPA DD PRLV SEPA ORANGE SA ECH/160214 ID EMETTEUR/FR24ZZZ123456 "
+    u"MDT/ABC123 REF/0042 LIB/FACTURE INTERNET TV TEL MOBILE FEVRIER 2014 "
+    u"CLIENT 0612345678 CONTRAT 987654321 PAYS FRANCE"
+).split()
+SIZES = (5, 10, 20, 30, 60, 120)
+
+
+def run(payee, runs):
+    """Return median time, in milliseconds, of completing payee."""
+    timings = []
+    for _ in range(runs):
+        start = time.time()
+        ui.complete_matches(payee)
+        timings.append(1000 * (time.time() - start))
+    return sorted(timings)[len(timings) // 2]
+
+
+def main(argv=None):
+    argv = argv or sys.argv
+    runs = int(argv[1]) if len(argv) > 1 else 10
+    for size in SIZES:
+        payee = u" ".join(WORDS[idx % len(WORDS)] for idx in range(size))
+        print("%3d words: %8.2f ms" % (size, run(payee, runs)))
+
+
+if __name__ == "__main__":
+    main()
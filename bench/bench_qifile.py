@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017-2020 Fabrice Laporte - kray.me
+# The MIT License http://www.opensource.org/licenses/mit-license.php
+
+"""Measure QIF parsing and dumping throughput, in lines per second, on a
+synthetic file.
+
+Usage: python bench/bench_qifile.py [LINES]
+"""
+
+from __future__ import print_function
+
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from qifqif import qifile  # noqa: E402
+
+TRANSACTION = (
+    u"D16/02/2014\n"
+    u"T-12.50\n"
+    u"PCARTE 16/02/2014 Sully bar %d\n"
+    u"Mchouffe\n"
+    u"XUnknown line\n"
+    u"^\n"
+)
+
+
+def write_synthetic_qif(path, lines):
+    """Write a QIF file of approximately given number of lines."""
+    per_transaction = TRANSACTION.count("\n")
+    with io.open(path, "w", encoding="utf-8") as fout:
+        for idx in range(lines // per_transaction):
+            fout.write(TRANSACTION % idx)
+
+
+def main(argv=None):
+    argv = argv or sys.argv
+    lines = int(argv[1]) if len(argv) > 1 else 10 ** 6
+    fd, path = tempfile.mkstemp(suffix=".qif")
+    os.close(fd)
+    try:
+        write_synthetic_qif(path, lines)
+        with io.open(path, "r", encoding="utf-8") as fin:
+            data = fin.readlines()
+        start = time.time()
+        transactions = qifile.parse_lines(data)
+        parse_time = time.time() - start
+        start = time.time()
+        qifile.dump_to_buffer(transactions)
+        dump_time = time.time() - start
+    finally:
+        os.unlink(path)
+    print("lines: %d" % len(data))
+    print("parse: %.0f lines/s (%.2fs)" % (len(data) / parse_time, parse_time))
+    print("dump:  %.0f lines/s (%.2fs)" % (len(data) / dump_time, dump_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017-2020 Fabrice Laporte - kray.me
+# The MIT License http://www.opensource.org/licenses/mit-license.php
+
+"""Measure wall time of short qifqif and qifacc invocations, dominated by
+interpreter startup and imports.
+
+Usage: python bench/bench_startup.py [RUNS]
+"""
+
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+RSRC = os.path.join(ROOT, "test", "rsrc")
+CFG_FILE = os.path.join(RSRC, "config.json")
+
+COMMANDS = [
+    ("python", "pass"),
+    ("import qifqif", "import qifqif"),
+    (
+        "qifqif --batch --dry-run",
+        "import qifqif; qifqif.main(['qifqif', '-b', '-d', '-c', %r, %r])"
+        % (CFG_FILE, os.path.join(RSRC, "transac.qif")),
+    ),
+    (
+        "qifacc --dry-run",
+        "from qifqif import qifacc; qifacc.main(['qifacc', '--dry-run', '-c', %r, "
+        "%r, '1'])" % (CFG_FILE, os.path.join(RSRC, "accounts.csv")),
+    ),
+]
+
+
+def run(code, runs):
+    """Return median wall time, in milliseconds, of running code."""
+    timings = []
+    with open(os.devnull, "w") as devnull:
+        for _ in range(runs):
+            start = time.time()
+            subprocess.check_call(
+                [sys.executable, "-c", code], cwd=ROOT, stdout=devnull
+            )
+            timings.append(1000 * (time.time() - start))
+    return sorted(timings)[len(timings) // 2]
+
+
+def main(argv=None):
+    argv = argv or sys.argv
+    runs = int(argv[1]) if len(argv) > 1 else 10
+    for (name, code) in COMMANDS:
+        print("%-26s %6.1f ms" % (name + ":", run(code, runs)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017-2020 Fabrice Laporte - kray.me
+# The MIT License http://www.opensource.org/licenses/mit-license.php
+
+"""Benchmark suite: time QIF parsing, dumping, rulers matching and the whole
+qifqif batch pipeline on synthetic data, and output results as JSON so that
+they can be compared between commits.
+
+Usage:
+    python bench/run.py -t 20000 -r 2000 -o before.json
+    python bench/run.py -t 20000 -r 2000 --compare before.json
+"""
+
+from __future__ import print_function
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, ROOT)
+
+import qifqif  # noqa: E402
+from qifqif import qifile, tags  # noqa: E402
+
+import synth  # noqa: E402
+
+
+def timed(func, repeat):
+    """Return best wall time of repeat calls to func."""
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def bench_parse(ctx):
+    qifile.parse_lines(ctx["lines"])
+    return len(ctx["lines"]), "lines"
+
+
+def bench_dump(ctx):
+    qifile.dump_to_buffer(ctx["transactions"])
+    return len(ctx["transactions"]), "transactions"
+
+
+def bench_match(ctx):
+    if tags.TAGS is not ctx.get("tags"):  # rule engine built during warm-up
+        ctx["tags"] = tags.load(ctx["config"], cache=False)
+    tags.MATCHES_CACHE_SIZE, size = 0, tags.MATCHES_CACHE_SIZE  # no memoization
+    try:
+        for t in ctx["transactions"]:
+            tags.find_tag_for(t)
+    finally:
+        tags.MATCHES_CACHE_SIZE = size
+    return len(ctx["transactions"]), "transactions"
+
+
+def bench_pipeline(ctx):
+    config = os.path.join(ctx["tmpdir"], "pipeline.json")
+    shutil.copy(ctx["config"], config)
+    argv = ["qifqif", "-b", "-d", "-c", config, ctx["qif"]] + ctx["qifqif_args"]
+    stdout = sys.stdout
+    with open(os.devnull, "w") as devnull:
+        sys.stdout = devnull  # contextlib.redirect_stdout is py3 only
+        try:
+            qifqif.main(argv)
+        finally:
+            sys.stdout = stdout
+    return len(ctx["transactions"]), "transactions"
+
+
+BENCHMARKS = [
+    ("parse", bench_parse),
+    ("dump", bench_dump),
+    ("match", bench_match),
+    ("pipeline", bench_pipeline),
+]
+
+
+def git_revision():
+    try:
+        return (
+            subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT)
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    tmpdir = tempfile.mkdtemp()
+    ctx = {
+        "tmpdir": tmpdir,
+        "qif": os.path.join(tmpdir, "bench.qif"),
+        "config": os.path.join(tmpdir, "bench.json"),
+        "qifqif_args": args.qifqif_args.split(),
+    }
+    try:
+        synth.write_files(
+            ctx["qif"], ctx["config"], args.transactions, args.rulers, args.seed
+        )
+        with io.open(ctx["qif"], "r", encoding="utf-8") as fin:
+            ctx["lines"] = fin.readlines()
+        ctx["transactions"] = qifile.parse_lines(ctx["lines"])
+        results = {}
+        for (name, func) in BENCHMARKS:
+            if args.only and name not in args.only:
+                continue
+            count, unit = func(ctx)  # warm-up
+            seconds = timed(lambda: func(ctx), args.repeat)
+            results[name] = {
+                "seconds": seconds,
+                "unit": unit,
+                "per_second": count / seconds if seconds else None,
+            }
+    finally:
+        shutil.rmtree(tmpdir)
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "params": {
+            "transactions": args.transactions,
+            "rulers": args.rulers,
+            "seed": args.seed,
+            "qifqif_args": args.qifqif_args,
+        },
+        "results": results,
+    }
+
+
+def print_report(report, reference=None, stream=sys.stdout):
+    print(
+        "revision %s, python %s" % (report["revision"], report["python"]),
+        file=stream,
+    )
+    for (name, res) in sorted(report["results"].items()):
+        line = "%-10s %9.3fs %12.0f %s/s" % (
+            name,
+            res["seconds"],
+            res["per_second"] or 0,
+            res["unit"],
+        )
+        ref = (reference or {}).get("results", {}).get(name)
+        if ref:
+            line += "  x%.2f vs %s" % (
+                ref["seconds"] / res["seconds"],
+                reference["revision"],
+            )
+        print(line, file=stream)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run qifqif benchmarks.")
+    parser.add_argument("-t", "--transactions", type=int, default=10000)
+    parser.add_argument("-r", "--rulers", type=int, default=1000)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument("-n", "--repeat", type=int, default=3)
+    parser.add_argument(
+        "--only", action="append", help="benchmark to run, can be repeated"
+    )
+    parser.add_argument(
+        "--qifqif-args", default="", help="extra arguments for pipeline benchmark"
+    )
+    parser.add_argument("-o", "--output", help="write JSON results to file")
+    parser.add_argument("--compare", help="JSON results file to compare with")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    reference = None
+    if args.compare:
+        with io.open(args.compare, "r", encoding="utf-8") as fin:
+            reference = json.load(fin)
+    if args.output:
+        with io.open(args.output, "w", encoding="utf-8") as fout:
+            fout.write(u"%s\n" % json.dumps(report, indent=4, sort_keys=True))
+        print_report(report, reference)
+    else:
+        print(json.dumps(report, indent=4, sort_keys=True))
+        print_report(report, reference, sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
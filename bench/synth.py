@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017-2020 Fabrice Laporte - kray.me
+# The MIT License http://www.opensource.org/licenses/mit-license.php
+
+"""Generate synthetic QIF files and qifqif configurations of any size, for
+benchmarking purposes. Number of transactions and number of rulers can be
+scaled independently.
+"""
+
+from __future__ import print_function
+
+import io
+import json
+import random
+import re
+
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+
+def vocabulary(size, rng):
+    """Return list of size distinct random lowercase words."""
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(LETTERS) for _ in range(rng.randint(4, 9))))
+    return sorted(words, key=lambda x: rng.random())
+
+
+def make_config(rulers, seed=0, words=None):
+    """Return config dict with given number of rulers: mostly basic payee
+    rulers, the others being substring, regex and multi-fields rulers.
+    """
+    rng = random.Random(seed)
+    words = words or vocabulary(2 * rulers + 10, rng)
+    res = {}
+    for idx in range(rulers):
+        keyword = words[idx].upper()
+        kind = rng.random()
+        if kind < 0.70:
+            ruler = keyword
+        elif kind < 0.85:
+            ruler = {"payee": re.escape(keyword[1:-1])}
+        elif kind < 0.95:
+            ruler = {"payee": re.escape(keyword), "memo": words[-idx - 1][:4]}
+        else:
+            ruler = {"payee": r"%s\d*\s+%s" % (keyword, words[idx + 1][:3])}
+        res.setdefault("Category %d" % rng.randint(0, 1 + rulers // 10), []).append(
+            ruler
+        )
+    return res
+
+
+def make_transactions(transactions, seed=0, words=None, hit_ratio=0.5):
+    """Yield QIF lines of given number of transactions, about hit_ratio of
+    them containing a word of the configuration vocabulary.
+    """
+    rng = random.Random(seed + 1)
+    words = words or vocabulary(1000, rng)
+    noise = vocabulary(500, random.Random(seed + 2))
+    for idx in range(transactions):
+        payee = [rng.choice(noise).upper() for _ in range(3)]
+        if rng.random() < hit_ratio:
+            payee[rng.randint(0, 2)] = rng.choice(words).upper()
+        yield u"D%02d/%02d/2020\n" % (1 + idx % 28, 1 + idx % 12)
+        yield u"T-%d.%02d\n" % (rng.randint(1, 500), rng.randint(0, 99))
+        yield u"PCARTE %02d/%02d %s\n" % (1 + idx % 28, 1 + idx % 12, " ".join(payee))
+        if rng.random() < 0.5:
+            yield u"M%s\n" % rng.choice(words + noise)
+        yield u"^\n"
+
+
+def write_files(qif_path, cfg_path, transactions, rulers, seed=0, hit_ratio=0.5):
+    """Write synthetic QIF file and configuration file."""
+    rng = random.Random(seed)
+    words = vocabulary(2 * rulers + 10, rng)
+    with io.open(cfg_path, "w", encoding="utf-8") as cfg:
+        cfg.write(u"%s" % json.dumps(make_config(rulers, seed, words), indent=4))
+    with io.open(qif_path, "w", encoding="utf-8") as qif:
+        for line in make_transactions(
+            transactions, seed, words[:rulers], hit_ratio=hit_ratio
+        ):
+            qif.write(line)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 5:
+        print("Usage: python bench/synth.py QIF_FILE CONFIG TRANSACTIONS RULERS")
+        sys.exit(1)
+    write_files(sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
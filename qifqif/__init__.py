@@ -11,14 +11,16 @@ from __future__ import print_function, unicode_literals
 
 import argparse
 import copy
+import glob
 import os
 import sys
 import io
 import re
-from prompt_toolkit import prompt
-from prompt_toolkit.completion import WordCompleter
+import shutil
+import tempfile
 
-from qifqif import tags, qifile
+from qifqif import columnar, tags, qifile, parallel, profiler, resume, stats
+from qifqif.atomic import atomic_open
 from qifqif.ui import complete_matches, colorize_match
 from qifqif.terminal import TERM
 
@@ -32,6 +34,10 @@ def quick_input(msg, choices="", sugg=None, clear=False):
     choice when empty string entered.
     The prompt line(s) get cleared when done if clear is True.
     """
+    # imported on first prompt, as batch mode can do without
+    from prompt_toolkit import prompt
+    from prompt_toolkit.completion import WordCompleter
+
     if not sugg:
         sugg = []
     default = [x for x in choices if x[0].isupper()]
@@ -94,24 +100,33 @@ def query_guru_ruler(t):
             if not field or field in matchable_fields:
                 break
         # Enter match
+        error = None
         while field:
             print(TERM.move_y(0))
             print_transaction(t, short=False, extras=extras)
             existing_match = guru_ruler.get(field, "")
             ruler = quick_input(
-                "\n%s match (%s)%s"
+                "%s\n%s match (%s)%s"
                 % (
+                    "\n" + TERM.red("%s Invalid regex: %s" % (TERM.KO, error))
+                    if error
+                    else "",
                     field.title(),
                     "regex" if regex else "chars",
                     " [%s]" % existing_match if existing_match else "",
                 ),
                 clear=True,
             )
+            error = None
             if ruler.isspace():  # remove field rule from ruler
                 extras.pop(field, None)
                 guru_ruler.pop(field, None)
             elif ruler:
-                guru_ruler[field] = r"%s" % ruler if regex else re.escape(ruler)
+                rule = r"%s" % ruler if regex else re.escape(ruler)
+                error = tags.rule_error(rule)
+                if error:  # prompt again
+                    continue
+                guru_ruler[field] = rule
             match, extras = check_ruler(guru_ruler, t)
             if match:
                 break
@@ -206,11 +221,13 @@ def process_transaction(t, options):
 
     if not t["category"]:  # Grab category from json cache
         cat, ruler, _ = tags.find_tag_for(t)
+        stats.count("matched" if cat else "missed")
         if cat:
             t["category"] = cat
             extras = {"category": "+ Category"}
 
-    print_transaction(t, extras=extras)
+    if not options["quiet"]:
+        print_transaction(t, extras=extras)
     edit = options["force"] > 1 or (options["force"] and t["category"] not in tags.TAGS)
     audit = options["audit"]
     if t["category"]:
@@ -240,7 +257,10 @@ def parse_args(argv):
         "See https://github.com/Kraymer/qifqif for more infos."
     )
     parser.add_argument(
-        "src", metavar="QIF_FILE", help=".QIF file to process", default=""
+        "src",
+        metavar="QIF_FILE",
+        nargs="+",
+        help=".QIF file(s) or glob pattern(s) of files to process",
     )
     audit_group = parser.add_mutually_exclusive_group()
     audit_group.add_argument(
@@ -257,6 +277,14 @@ def parse_args(argv):
         dest="batch",
         help=("skip transactions that require user input"),
     )
+    parser.add_argument(
+        "--backups",
+        dest="backups",
+        metavar="N",
+        type=int,
+        default=0,
+        help=("keep N rolling backups of overwritten files. DEFAULT: 0"),
+    )
     parser.add_argument(
         "-c",
         "--config",
@@ -272,6 +300,16 @@ def parse_args(argv):
         action="store_true",
         help=("just print instead of writing file"),
     )
+    parser.add_argument(
+        "--engine",
+        dest="engine",
+        choices=("rows", "columnar"),
+        default="rows",
+        help=(
+            "match transactions one at a time (rows) or by batches, a field "
+            "at a time (columnar), in batch mode. DEFAULT: rows"
+        ),
+    )
     parser.add_argument(
         "-f",
         "--force",
@@ -283,13 +321,102 @@ def parse_args(argv):
             "transactions."
         ),
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        metavar="N",
+        type=int,
+        default=1,
+        help=("match transactions using N processes, in batch mode. DEFAULT: 1"),
+    )
+    parser.add_argument(
+        "--match-cache",
+        dest="match-cache",
+        metavar="N",
+        type=int,
+        default=tags.MATCHES_CACHE_SIZE,
+        help=(
+            "remember matching results of the N last distinct payees (and "
+            "other fields looked at by rulers). DEFAULT: %d" % tags.MATCHES_CACHE_SIZE
+        ),
+    )
     dest_group.add_argument(
         "-o",
         "--output",
         dest="dest",
-        help=("output filename. DEFAULT: edit input file in-place"),
+        help=(
+            "output filename, or directory when processing several files. "
+            "DEFAULT: edit input files in-place"
+        ),
         default="",
     )
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        action="count",
+        default=0,
+        help=(
+            "don't print transactions, in batch mode: only write output and "
+            "print a one line summary per file to stderr. Repeat the flag "
+            "(-qq) to drop the summary too."
+        ),
+    )
+    parser.add_argument(
+        "-r",
+        "--resume",
+        dest="resume",
+        action="store_true",
+        help=(
+            "save a checkpoint when interrupted, and skip transactions already "
+            "processed by a previous run with this flag on the same file"
+        ),
+    )
+    parser.add_argument(
+        "--rule-budget",
+        dest="rule-budget",
+        metavar="MS",
+        type=float,
+        default=0,
+        help=(
+            "ignore rulers once they take more than MS milliseconds to "
+            "evaluate on a transaction"
+        ),
+    )
+    parser.add_argument(
+        "--save-every",
+        dest="save-every",
+        metavar="N",
+        type=int,
+        default=1,
+        help=(
+            "save configuration after every N edits, 0 to save only when "
+            "done. DEFAULT: 1"
+        ),
+    )
+    parser.add_argument(
+        "--save-interval",
+        dest="save-interval",
+        metavar="SECONDS",
+        type=float,
+        default=0,
+        help=(
+            "also save configuration edits once SECONDS elapsed since last "
+            "save, checked before each transaction"
+        ),
+    )
+    parser.add_argument(
+        "--stats",
+        dest="stats",
+        action="store_true",
+        help=("print time spent per stage and matching statistics to stderr"),
+    )
+    parser.add_argument(
+        "--stats-json",
+        dest="stats-json",
+        metavar="FILE",
+        help=("write time spent per stage and matching statistics to FILE"),
+    )
     parser.add_argument(
         "-v",
         "--version",
@@ -298,55 +425,232 @@ def parse_args(argv):
         help="display version information and exit",
     )
     args = vars(parser.parse_args(args=argv[1:]))
-    if not args["dest"]:
-        args["dest"] = args["src"]
+    if args["jobs"] > 1 and not args["batch"]:
+        parser.error("argument -j/--jobs: requires -b/--batch")
+    if args["quiet"] and not args["batch"]:
+        parser.error("argument -q/--quiet: requires -b/--batch")
+    if args["engine"] == "columnar":
+        if not args["batch"]:
+            parser.error("argument --engine: columnar requires -b/--batch")
+        if args["jobs"] > 1 or args["rule-budget"]:
+            parser.error(
+                "argument --engine: columnar is incompatible with -j/--jobs "
+                "and --rule-budget"
+            )
+    if args["match-cache"] < 1:
+        parser.error("argument --match-cache: must be at least 1")
+    if args["rule-budget"] and not profiler.RuleBudget.supported():
+        parser.error("argument --rule-budget: not supported on this platform")
+    srcs = []
+    for pattern in args["src"]:
+        matches = sorted(glob.glob(pattern)) if re.search(r"[*?[]", pattern) else []
+        for src in matches or [pattern]:
+            if src not in srcs:
+                srcs.append(src)
+    if len(srcs) > 1 and args["dest"] and not os.path.isdir(args["dest"]):
+        parser.error("argument -o/--output: must be a directory for several files")
+    args["files"] = []
+    for src in srcs:
+        dest = args["dest"] or src
+        if os.path.isdir(dest):
+            dest = os.path.join(dest, os.path.basename(src))
+        if os.path.abspath(dest) in [os.path.abspath(x[1]) for x in args["files"]]:
+            parser.error(
+                "argument -o/--output: several files would be written to '%s'" % dest
+            )
+        args["files"].append((src, dest))
+    # options of first file, for callers processing a single file
+    args["src"], args["dest"] = args["files"][0]
     return args
 
 
-def process_transactions(transactions, options):
-    """Process file's transactions."""
-    cat = None
+def iter_processed_transactions(transactions, options, status=None):
+    """Process transactions one at a time and yield them. On Ctrl+C,
+    remaining transactions are yielded untouched. status["count"] is set to
+    the number of transactions processed before interruption, if any, and
+    status["categorized"] to the number of them having a category.
+    """
+    if status is None:
+        status = {}
+    status["count"] = status["categorized"] = 0
+    quiet = options["quiet"]
+    transactions = iter(transactions)
+    t = None
     try:
         i = 0
         for (i, t) in enumerate(transactions):
-            print("\n---")
+            tags.save_if_due(options)  # edits pending while user was prompted
+            if not quiet:
+                print("\n---")
             if not t["payee"]:
-                print_transaction(t)
-                print("Skip transaction #%s with no payee field" % (i + 1))
-                continue
-            cat, match = process_transaction(t, options)
-            tags.edit(t, cat, match, options)
-        i = i + 1
+                if not quiet:
+                    print_transaction(t)
+                    print("Skip transaction #%s with no payee field" % (i + 1))
+            else:
+                cat, match = process_transaction(t, options)
+                tags.edit(t, cat, match, options)
+            status["count"] = i + 1
+            status["categorized"] += bool(t["category"])
+            yield t
+            t = None
         if not options["batch"]:
             quick_input("\nPress any key to continue (Ctrl+D to discard " "edits)")
     except KeyboardInterrupt:
-        return transactions[:i]
-    return transactions[:i]
+        if t is not None:
+            yield t
+        for t in transactions:
+            yield t
+    if not options.get("dry-run"):
+        tags.flush(options["config"], options.get("backups", 0))
+
+
+def process_transactions(transactions, options):
+    """Process file's transactions."""
+    status = {}
+    res = list(iter_processed_transactions(transactions, options, status))
+    return res[: status["count"]]
+
+
+def write_transactions(transactions, dest):
+    """Write transactions to dest file object, timing it if asked to."""
+    if stats.ENABLED:
+        dest = stats.TimedWriter(dest, "write")
+    return qifile.write_transactions(transactions, dest)
+
+
+def process_file(options):
+    """Categorize transactions of options["src"] file and write them to
+    options["dest"] file. Return a tuple (processed, total) of transactions
+    counts, processed being lower than total if user interrupted processing.
+    """
+    status = {}
+    # Transactions are streamed from input to output. Output is committed
+    # only once all transactions have been written.
+    with io.open(options["src"], "rb") as fin:
+        skipped, prefix, reader = 0, u"", None
+        if options["resume"]:
+            skipped, prefix = resume.skip(
+                options["src"], fin, options["config"], options["dest"]
+            )
+            reader = resume.LineReader(fin)
+            transacs = reader.track(qifile.iter_transactions(reader, options))
+        else:
+            lines = io.TextIOWrapper(fin, encoding="utf-8", errors="ignore")
+            transacs = qifile.iter_transactions(lines, options=options)
+        if skipped and not options["quiet"]:
+            print("Skip %d transactions already processed" % skipped)
+        if stats.ENABLED:
+            transacs = stats.timed_iter(transacs, "parse", "transactions")
+        if options["jobs"] > 1:
+            transacs = parallel.MatchPrefetcher(transacs, options["jobs"])
+        elif options["engine"] == "columnar":
+            transacs = columnar.ColumnarPrefetcher(transacs)
+        transacs = iter_processed_transactions(transacs, options, status)
+        if options.get("dry-run"):
+            dest = tempfile.SpooledTemporaryFile(
+                max_size=2 ** 24, mode="w+", encoding="utf-8"
+            )
+            dest.write(prefix)
+            total = write_transactions(transacs, dest)
+        else:
+            with atomic_open(options["dest"], options["backups"]) as dest:
+                dest.write(prefix)
+                total = write_transactions(transacs, dest)
+    processed, total = skipped + status["count"], skipped + total
+    if options["resume"] and not options.get("dry-run"):
+        if processed < total:
+            resume.save(
+                options["dest"],
+                processed,
+                options["config"],
+                options["src"],
+                reader.end_of(status["count"]),
+            )
+        else:
+            resume.clear(options["dest"])
+    if options["quiet"]:
+        if options.get("dry-run"):  # the QIF is the only output
+            with dest:
+                dest.seek(0)
+                shutil.copyfileobj(dest, sys.stdout)
+        if options["quiet"] == 1:
+            print_summary(options["src"], status, skipped, total)
+    elif options["batch"] or options["dry-run"]:
+        if not options.get("dry-run"):
+            dest = io.open(options["dest"], "r", encoding="utf-8")
+        with dest:
+            dest.seek(0)
+            print("")
+            shutil.copyfileobj(dest, sys.stdout)
+            print("")
+    return processed, total
+
+
+def print_summary(src, status, skipped, total):
+    """Print one line summary of src file processing to stderr, skipped
+    transactions being the ones resumed from a previous run.
+    """
+    line = "%s: %d/%d transactions processed, %d categorized" % (
+        src,
+        skipped + status["count"],
+        total,
+        status["categorized"],
+    )
+    if skipped:
+        line += ", %d resumed" % skipped
+    print(line, file=sys.stderr)
+
+
+def process_files(args):
+    """Process files listed in args["files"]. Return exit code."""
+    with stats.timer("load"):
+        original_tags = copy.deepcopy(tags.load(args["config"]))
+    tags.MATCHES_CACHE_SIZE = args["match-cache"]
+    if args["rule-budget"]:
+        tags.RULE_BUDGET = profiler.RuleBudget(args["rule-budget"] / 1000.0)
+        tags.RULE_BUDGET.start()
+    res = 0
+    try:
+        for (src, dest) in args["files"]:
+            try:
+                processed, total = process_file(dict(args, src=src, dest=dest))
+            except (IOError, OSError) as err:
+                print("Error processing '%s'.\n%s" % (src, err), file=sys.stderr)
+                res = 1
+                continue
+            if processed != total:  # interrupted by user
+                return 1
+    except EOFError:  # exit on Ctrl + D: restore original tags
+        tags.save(args["config"], original_tags)
+        return 1
+    finally:
+        parallel.shutdown()
+        if tags.RULE_BUDGET is not None:
+            tags.RULE_BUDGET.stop()
+            tags.RULE_BUDGET = None
+    return res
 
 
 def main(argv=None):
     """Main function: Parse, process, print"""
     if argv is None:
         argv = sys.argv
+    if argv[1:2] == ["profile-rules"]:
+        return profiler.main(argv[1:])
     args = parse_args(argv)
     if not args:
         exit(1)
-    original_tags = copy.deepcopy(tags.load(args["config"]))
-    with io.open(args["src"], "r", encoding="utf-8", errors="ignore") as fin:
-        lines = fin.readlines()
-        transacs_orig = qifile.parse_lines(lines, options=args)
+    if not (args["stats"] or args["stats-json"]):
+        return process_files(args)
+    stats.enable()
     try:
-        transacs = process_transactions(transacs_orig, options=args)
-    except EOFError:  # exit on Ctrl + D: restore original tags
-        tags.save(args["config"], original_tags)
-        return 1
-    res = qifile.dump_to_buffer(transacs + transacs_orig[len(transacs) :])
-    if not args.get("dry-run"):
-        with io.open(args["dest"], "w", encoding="utf-8") as dest:
-            dest.write(res)
-    if args["batch"] or args["dry-run"]:
-        print("\n" + res)
-    return 0 if len(transacs) == len(transacs_orig) else 1
+        with stats.timer("total"):
+            return process_files(args)
+    finally:
+        if args["stats"]:
+            stats.print_report(sys.stderr)
+        if args["stats-json"]:
+            stats.write_report(args["stats-json"])
 
 
 if __name__ == "__main__":
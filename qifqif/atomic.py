@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017-2020 Fabrice Laporte - kray.me
+# The MIT License http://www.opensource.org/licenses/mit-license.php
+
+"""Crash-safe file writes: content is written to a temporary file that
+replaces the destination only once complete and synced on disk.
+"""
+
+import io
+import os
+import shutil
+import stat
+import tempfile
+from contextlib import contextmanager
+
+replace = getattr(os, "replace", os.rename)  # python 2: not atomic on Windows
+
+
+def backup_name(filepath, idx):
+    """Return filename of idx-th backup of filepath."""
+    return "%s.%d" % (filepath, idx)
+
+
+def rotate_backups(filepath, backups):
+    """Shift existing backups of filepath and make filepath the first one."""
+    if not backups or not os.path.isfile(filepath):
+        return
+    for idx in range(backups - 1, 0, -1):
+        if os.path.isfile(backup_name(filepath, idx)):
+            replace(backup_name(filepath, idx), backup_name(filepath, idx + 1))
+    first = backup_name(filepath, 1)
+    if os.path.isfile(first):
+        os.remove(first)
+    try:
+        os.link(filepath, first)
+    except (AttributeError, OSError):
+        shutil.copy2(filepath, first)
+
+
+def _fsync_dir(dirpath):
+    try:
+        fd = os.open(dirpath, os.O_RDONLY)
+    except (AttributeError, OSError):  # Windows
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _file_mode(filepath):
+    """Return permissions of filepath, or default ones if it doesn't exist."""
+    if os.path.isfile(filepath):
+        return stat.S_IMODE(os.stat(filepath).st_mode)
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+@contextmanager
+def atomic_open(filepath, backups=0, encoding="utf-8"):
+    """Open a temporary file for writing text that atomically replaces
+    filepath when the block exits without error. Original file is kept as
+    first of `backups` rolling backups, if any.
+    File is opened in binary mode if encoding is None.
+    """
+    filepath = os.path.realpath(filepath)
+    dirpath, basename = os.path.split(filepath)
+    fd, tmppath = tempfile.mkstemp(prefix=".%s." % basename, suffix=".tmp", dir=dirpath)
+    try:
+        with io.open(fd, "wb" if encoding is None else "w", encoding=encoding) as tmp:
+            yield tmp
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        os.chmod(tmppath, _file_mode(filepath))
+        rotate_backups(filepath, backups)
+        replace(tmppath, filepath)
+    except BaseException:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        raise
+    _fsync_dir(dirpath)
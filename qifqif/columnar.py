@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017-2020 Fabrice Laporte - kray.me
+# The MIT License http://www.opensource.org/licenses/mit-license.php
+
+"""Matching of transactions by batches, a ruler being applied at once to
+the column of distinct values of a field instead of transaction by
+transaction.
+"""
+
+from bisect import bisect_right
+from itertools import compress
+
+from six import string_types
+
+from qifqif import stats, tags
+from qifqif.matching import fold
+
+CHUNK_SIZE = 4096
+SEPARATOR = u"\x00"
+
+
+class Column(object):
+    """Distinct non-empty values of a field across rows, and rows holding
+    each of them.
+    """
+
+    def __init__(self, values):
+        self.values = []
+        self.rows = []  # value code -> rows
+        self.codes = []  # row -> value code, None if no value
+        codes = {}
+        for (row, value) in enumerate(values):
+            if not value or not isinstance(value, string_types):
+                self.codes.append(None)
+                continue
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(self.values)
+                self.values.append(value)
+                self.rows.append([])
+            self.rows[code].append(row)
+            self.codes.append(code)
+        self._blob = None
+        self._starts = None
+
+    def containing(self, literal):
+        """Return codes of values whose folded form contains literal."""
+        if SEPARATOR in literal:
+            return range(len(self.values))
+        if self._blob is None:
+            folded = [fold(value) for value in self.values]
+            self._blob = SEPARATOR.join(folded)
+            self._starts, start = [], 0
+            for value in folded:
+                self._starts.append(start)
+                start += len(value) + 1
+        res = []
+        pos = self._blob.find(literal)
+        while pos >= 0:
+            code = bisect_right(self._starts, pos) - 1
+            res.append(code)
+            if code + 1 == len(self._starts):
+                break
+            pos = self._blob.find(literal, self._starts[code + 1])
+        return res
+
+    def search(self, rule, codes=None):
+        """Return dict mapping codes of values, among given ones, to the span
+        of the non empty part of them matched by rule.
+        """
+        pattern = tags.compile_rule(rule)
+        if codes is None:
+            values = self.values
+            codes = range(len(values))
+        else:
+            values = [self.values[code] for code in codes]
+        res = {}
+        stats.count("regex_evaluations", len(values))
+        found = list(map(pattern.search, values))
+        for (code, m) in compress(zip(codes, found), found):
+            if m.end() > m.start():
+                res[code] = m.span()
+        return res
+
+
+def match_columns(engine, keys):
+    """Return find_tag_for() results of transactions having given cache
+    keys, ie values of engine.fields.
+    """
+    if engine.index is None:
+        engine.build_index()
+    columns = dict(
+        (field, Column([key[idx] for key in keys]))
+        for (idx, field) in enumerate(engine.fields)
+    )
+    found = [[] for _ in keys]  # row -> (entry rank, tag, ruler, matches)
+    for entries in engine.groups.values():
+        for entry in entries:
+            for (row, matches) in _match_entry(entry, columns):
+                found[row].append((entry[0], entry[1], entry[2], matches))
+    payees = columns.get("payee")
+    if engine.index and payees is not None:
+        for (code, payee) in enumerate(payees.values):
+            for (entry, matches) in _match_words(engine, payee):
+                for row in payees.rows[code]:
+                    found[row].append((entry[0], entry[1], entry[2], matches))
+    res = []
+    for matched in found:
+        matched.sort(key=lambda x: x[0])
+        res.append(tags.best_match([x[1:] for x in matched]))
+    return res
+
+
+def _match_entry(entry, columns):
+    """Yield (row, matches) tuples for rows matched by rule engine entry."""
+    stats.count("ruler_evaluations")
+    rules, literal = list(dict(entry[3]).items()), entry[4]  # as match_compiled()
+    if literal is not None:  # start with the most selective rule
+        rules.sort(key=lambda x: x[0] != literal[0])
+    rows = None
+    hits = {}  # field -> {code: match}
+    for (field, rule) in rules:
+        column = columns[field]
+        if not column.values:
+            return
+        if rows is not None:
+            codes = sorted(set(column.codes[row] for row in rows) - {None})
+        elif literal is not None and field == literal[0]:
+            codes = column.containing(literal[1])
+        else:
+            codes = None
+        hits[field] = column.search(rule, codes)
+        matched = set(row for code in hits[field] for row in column.rows[code])
+        rows = matched if rows is None else rows & matched
+        if not rows:
+            return
+    for row in sorted(rows):
+        yield row, dict(
+            (field, hits[field][columns[field].codes[row]]) for (field, _) in rules
+        )
+
+
+def _match_words(engine, payee):
+    """Yield (entry, matches) tuples for basic rulers matching payee."""
+    for entry in engine.index_candidates(payee):
+        stats.count("ruler_evaluations")
+        stats.count("regex_evaluations", len(entry[3]))
+        m, matches = tags.match_compiled(entry[3], {"payee": payee})
+        if m:
+            yield entry, matches
+
+
+class ColumnarPrefetcher(tags.Prefetcher):
+    """tags.Prefetcher computing results of chunks of transactions with
+    match_columns().
+    """
+
+    def __init__(self, transactions, chunk_size=CHUNK_SIZE):
+        tags.Prefetcher.__init__(self, transactions, chunk_size)
+
+    def _prefetch(self):
+        chunk = self._chunk()
+        keys = [self.engine.cache_key(t) for t in chunk]
+        distinct = list(set(keys))
+        with stats.timer("match"):
+            results = dict(zip(distinct, match_columns(self.engine, distinct)))
+        self.ready.extend((t, key, results[key]) for (t, key) in zip(chunk, keys))
@@ -14,3 +14,8 @@ FIELDS = {
 }
 EXTRA_FIELDS = {"F": u"filename"}
 FIELDS_FULL = dict(list(FIELDS.items()) + list(EXTRA_FIELDS.items()))
+
+# Lookup tables for QIF parsing and dumping
+FIELDS_NAMES = tuple(FIELDS.values())
+REVERSE_FIELDS = dict((v, k) for (k, v) in FIELDS.items())
+EXTRA_FIELDS_NAMES = frozenset(EXTRA_FIELDS.values())
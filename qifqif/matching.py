@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017-2020 Fabrice Laporte - kray.me
+# The MIT License http://www.opensource.org/licenses/mit-license.php
+
+"""Low-level helpers used by the rule engine to avoid running regexes on
+transactions that cannot match.
+"""
+
+import re
+
+from six import unichr
+
+try:  # python >= 3.11
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:
+    import sre_constants
+    import sre_parse
+
+try:
+    from _sre import unicode_tolower as _tolower
+except ImportError:  # python < 3.7
+
+    def _tolower(code):
+        return ord(("%c" % code).lower()[0])
+
+
+try:
+    from re._casefix import _EXTRA_CASES
+except ImportError:
+    try:
+        from sre_compile import _ignorecase_fixes as _EXTRA_CASES
+    except ImportError:
+        _EXTRA_CASES = {}
+
+
+class _FoldTable(dict):
+    """Translation table mapping a character to the representative of the
+    characters it matches under re.IGNORECASE. Filled on demand.
+    """
+
+    def __missing__(self, code):
+        low = _tolower(code)
+        res = min((low,) + tuple(_EXTRA_CASES.get(low, ())))
+        self[code] = res
+        return res
+
+
+_FOLD_TABLE = _FoldTable()
+_WORD_RE = re.compile(r"\w+", re.U)
+# Folded characters that are case-insensitively equal to both word and
+# non-word characters, eg U+0345 and greek iota.
+_MIXED = set(
+    unichr(_FOLD_TABLE[low])
+    for (low, extras) in _EXTRA_CASES.items()
+    if len(set(bool(_WORD_RE.match(unichr(x))) for x in (low,) + extras)) > 1
+)
+
+
+def fold(text):
+    """Return text case-folded the way re.IGNORECASE compares characters, so
+    that a regex literal can only match text if fold(literal) is in
+    fold(text).
+    """
+    try:
+        if text.isascii():
+            return text.lower()
+    except AttributeError:  # python < 3.7
+        pass
+    return text.translate(_FOLD_TABLE)
+
+
+def tokenize(text):
+    """Return folded words of text."""
+    return [fold(word) for word in _WORD_RE.findall(text)]
+
+
+def keyword_tokens(keyword):
+    """Return folded words of keyword if any text matched by regex
+    r"\bkeyword\b" under re.IGNORECASE has them as consecutive words. None
+    otherwise.
+    """
+    if _MIXED.intersection(fold(keyword)):
+        return None
+    return tokenize(keyword) or None
+
+
+_REPEATS = tuple(
+    getattr(sre_constants, name)
+    for name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT")
+    if hasattr(sre_constants, name)
+)
+
+
+def _literals(items):
+    """Yield runs of literal characters codes that any match of parsed
+    pattern items contains.
+    """
+    run = []
+    for (op, av) in items:
+        if op == sre_constants.LITERAL:
+            run.append(av)
+            continue
+        if run:
+            yield run
+            run = []
+        if op == sre_constants.SUBPATTERN:
+            for x in _literals(av[-1]):
+                yield x
+        elif op in _REPEATS and av[0] >= 1:
+            for x in _literals(av[2]):
+                yield x
+    if run:
+        yield run
+
+
+def required_literal(rule):
+    """Return the longest literal, folded, that any text matched by rule
+    under re.IGNORECASE contains. None if there is none.
+    """
+    try:
+        runs = list(_literals(sre_parse.parse(rule, re.I)))
+    except Exception:
+        return None
+    if not runs:
+        return None
+    return fold(u"".join(unichr(code) for code in max(runs, key=len)))
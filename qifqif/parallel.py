@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017-2020 Fabrice Laporte - kray.me
+# The MIT License http://www.opensource.org/licenses/mit-license.php
+
+"""Matching of transactions against rulers across worker processes."""
+
+import signal
+from collections import OrderedDict, deque
+
+from qifqif import tags
+
+CHUNK_SIZE = 256
+POOL = None
+_POOL_KEY = None
+
+
+def _init_worker(tags_dict, budget):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # interruption is up to parent
+    tags.TAGS = tags_dict
+    if budget:
+        from qifqif.profiler import RuleBudget
+
+        tags.RULE_BUDGET = RuleBudget(budget)
+        tags.RULE_BUDGET.start()  # for process lifetime
+
+
+def _match_chunk(fields, keys):
+    return [tags.find_tag_for(dict(zip(fields, key))) for key in keys]
+
+
+def get_pool(jobs):
+    """Return pool of worker processes holding current TAGS rulers, starting
+    it if needed. The pool is reused as long as TAGS is not edited.
+    """
+    global POOL, _POOL_KEY
+    import multiprocessing  # costly import, only needed with several jobs
+
+    tags.get_engine()  # sync VERSION with TAGS
+    budget = tags.RULE_BUDGET.seconds if tags.RULE_BUDGET else 0
+    if POOL is not None and _POOL_KEY != (jobs, tags.VERSION, budget):
+        shutdown()
+    if POOL is None:
+        POOL = multiprocessing.Pool(jobs, _init_worker, (tags.TAGS, budget))
+        _POOL_KEY = (jobs, tags.VERSION, budget)
+    return POOL
+
+
+def shutdown():
+    """Stop worker processes, if any."""
+    global POOL
+    if POOL is not None:
+        POOL.terminate()
+        POOL.join()
+        POOL = None
+
+
+class MatchPrefetcher(tags.Prefetcher):
+    """tags.Prefetcher computing results of chunks of transactions with a pool
+    of worker processes, each one holding its own copy of the compiled
+    rulers.
+    """
+
+    def __init__(self, transactions, jobs, chunk_size=CHUNK_SIZE):
+        tags.Prefetcher.__init__(self, transactions, chunk_size)
+        self.depth = 2 * jobs  # max number of chunks being matched
+        self.pool = get_pool(jobs)
+        self.pending = deque()  # (transactions, keys, distinct keys, result)
+
+    def close(self, abort=False):
+        """Stop using worker processes. On abort, they are stopped too as
+        their pending results are of no use anymore.
+        """
+        if self.pool is not None and (abort or self.pending):
+            shutdown()
+        self.pool = None
+
+    def stop(self):
+        tags.Prefetcher.stop(self)
+        self.close(abort=True)
+
+    def _chunk(self):
+        if self.pending:  # submitted but not matched
+            return self.pending.popleft()[0]
+        return tags.Prefetcher._chunk(self)
+
+    def _submit(self):
+        chunk = tags.Prefetcher._chunk(self)
+        if not chunk:
+            return False
+        keys = [self.engine.cache_key(t) for t in chunk]
+        try:  # match each distinct key once
+            distinct = list(OrderedDict.fromkeys(keys))
+        except TypeError:  # unhashable field value
+            distinct = keys
+        result = self.pool.apply_async(_match_chunk, (self.engine.fields, distinct))
+        self.pending.append((chunk, keys, distinct, result))
+        return True
+
+    def _prefetch(self):
+        while len(self.pending) < self.depth and self._submit():
+            pass
+        if not self.pending:
+            return
+        chunk, keys, distinct, result = self.pending[0]
+        try:
+            matches = result.get()
+        except BaseException:  # Ctrl+C: keep chunk to be yielded as is
+            self.stop()
+            raise
+        self.pending.popleft()
+        if distinct is not keys:
+            matches = dict(zip(distinct, matches))
+            matches = [matches[key] for key in keys]
+        self.ready.extend(zip(chunk, keys, matches))
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017-2020 Fabrice Laporte - kray.me
+# The MIT License http://www.opensource.org/licenses/mit-license.php
+
+"""Detection of rulers whose regexes are too slow: `qifqif profile-rules`
+command and time budget enforced on rulers while matching.
+"""
+
+from __future__ import print_function
+
+import argparse
+import io
+import json
+import os
+import signal
+import sys
+
+from qifqif import qifile, stats, tags
+
+THRESHOLD = 10  # milliseconds
+
+
+class RuleTimeout(Exception):
+    """Raised when a ruler exceeds its time budget."""
+
+
+class RuleBudget(object):
+    """Time limit for the evaluation of a ruler against a transaction.
+
+    Running regexes cannot be preempted by a thread, but they check for
+    signals: a periodic SIGALRM, armed only while rulers are evaluated,
+    interrupts the ruler being evaluated once it has exceeded the budget.
+    Such a ruler is then considered as not matching and is quarantined, ie
+    not evaluated anymore for the rest of the run.
+    Only available on Unix, from the main thread.
+    """
+
+    def __init__(self, seconds, stream=None):
+        self.seconds = seconds
+        self.stream = stream
+        self.quarantined = {}  # compiled rules -> (tag, ruler)
+        self.started = None  # evaluation start time of current ruler
+        self._handler = None
+
+    @staticmethod
+    def supported():
+        return hasattr(signal, "setitimer")
+
+    def start(self):
+        """Start checking rulers evaluation time, when armed."""
+        self._handler = signal.signal(signal.SIGALRM, self._alarm)
+
+    def stop(self):
+        self.disarm()
+        signal.signal(signal.SIGALRM, self._handler)
+
+    def arm(self):
+        """Fire alarms until disarmed, while rulers get evaluated."""
+        tick = self.seconds / 2
+        signal.setitimer(signal.ITIMER_REAL, tick, tick)
+
+    def disarm(self):
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _alarm(self, signum, frame):
+        started = self.started
+        if started is not None and stats.perf_counter() - started > self.seconds:
+            self.started = None
+            raise RuleTimeout()
+
+    def match(self, entry, t):
+        """Like tags.match_compiled() for a rule engine entry, considering it
+        does not match if it exceeds the budget.
+        """
+        (_, tag, ruler, rules, _) = entry
+        if rules in self.quarantined:
+            return False, {}
+        self.started = stats.perf_counter()
+        try:
+            res = tags.match_compiled(rules, t)
+            self.started = None
+        except RuleTimeout:
+            self.quarantine(tag, ruler, rules)
+            return False, {}
+        return res
+
+    def quarantine(self, tag, ruler, rules):
+        self.quarantined[rules] = (tag, ruler)
+        print(
+            "Ruler %s of category '%s' exceeded %gms time budget, ignored "
+            "from now on." % (json.dumps(ruler), tag, 1000 * self.seconds),
+            file=self.stream or sys.stderr,
+        )
+
+
+def profile(transactions, budget=None):
+    """Evaluate every ruler against every transaction, and return a list of
+    [tag, ruler, evaluations, total seconds, worst seconds, timed out]
+    profiles, in tags dictionary order. Index is bypassed so that all
+    rulers get evaluated.
+    """
+    engine = tags.get_engine()
+    engine.build_index()
+    entries = engine.entries
+    profiles = [[entry[1], entry[2], 0, 0.0, 0.0, False] for entry in entries]
+    perf_counter = stats.perf_counter
+    for t in transactions:
+        if budget is not None:
+            budget.arm()
+        try:
+            for (entry, prof) in zip(entries, profiles):
+                if prof[5]:
+                    continue
+                start = perf_counter()
+                if budget is None:
+                    tags.match_compiled(entry[3], t)
+                else:
+                    budget.match(entry, t)
+                    prof[5] = entry[3] in budget.quarantined
+                elapsed = perf_counter() - start
+                prof[2] += 1
+                prof[3] += elapsed
+                prof[4] = max(prof[4], elapsed)
+        finally:
+            if budget is not None:
+                budget.disarm()
+    return profiles
+
+
+def parse_args(argv):
+    """Build profile-rules command argument parser and parse command line."""
+    parser = argparse.ArgumentParser(
+        prog="qifqif profile-rules",
+        description="Time every ruler of config against transactions of "
+        "QIF files, to spot the slow ones.",
+    )
+    parser.add_argument(
+        "src", metavar="QIF_FILE", nargs="+", help=".QIF file(s) to replay"
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        dest="config",
+        help="configuration filename in json format. DEFAULT: ~/.qifqif.json",
+        default=os.path.join(os.path.expanduser("~"), ".qifqif.json"),
+    )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        dest="threshold",
+        metavar="MS",
+        type=float,
+        default=THRESHOLD,
+        help=(
+            "flag rulers taking more than MS milliseconds on a transaction. "
+            "DEFAULT: %d" % THRESHOLD
+        ),
+    )
+    parser.add_argument(
+        "--rule-budget",
+        dest="rule-budget",
+        metavar="MS",
+        type=float,
+        default=0,
+        help=("interrupt rulers taking more than MS milliseconds"),
+    )
+    parser.add_argument(
+        "-n",
+        "--top",
+        dest="top",
+        metavar="N",
+        type=int,
+        default=20,
+        help=("number of slowest rulers to list, besides flagged ones"),
+    )
+    args = vars(parser.parse_args(args=argv[1:]))
+    if args["rule-budget"] and not RuleBudget.supported():
+        parser.error("argument --rule-budget: not supported on this platform")
+    return args
+
+
+def print_profiles(profiles, threshold, top):
+    """Print profiles of flagged rulers and of the top slowest ones. Return
+    number of flagged rulers.
+    """
+    flagged = 0
+    profiles = sorted(profiles, key=lambda x: (-x[5], -x[4], -x[3]))
+    print(
+        "%12s %12s %12s  %s" % ("total ms", "worst ms", "evaluations", "ruler"),
+    )
+    for (idx, (tag, ruler, evals, total, worst, timeout)) in enumerate(profiles):
+        slow = timeout or 1000 * worst > threshold
+        if not slow and idx >= top:
+            break
+        flagged += slow
+        print(
+            "%12.3f %12.3f %12d  %s: %s%s"
+            % (
+                1000 * total,
+                1000 * worst,
+                evals,
+                tag,
+                json.dumps(ruler),
+                "  [TIMEOUT]" if timeout else "  [SLOW]" if slow else "",
+            )
+        )
+    return flagged
+
+
+def main(argv):
+    """profile-rules command: exit status is 1 if some rulers are flagged."""
+    args = parse_args(argv)
+    tags.load(args["config"])
+    transactions = []
+    for src in args["src"]:
+        with io.open(src, "r", encoding="utf-8", errors="ignore") as fin:
+            transactions.extend(qifile.iter_transactions(fin))
+    if args["rule-budget"]:
+        with RuleBudget(args["rule-budget"] / 1000.0) as budget:
+            profiles = profile(transactions, budget)
+    else:
+        profiles = profile(transactions)
+    flagged = print_profiles(profiles, args["threshold"], args["top"])
+    print(
+        "%d rulers evaluated against %d transactions, %d flagged."
+        % (len(profiles), len(transactions), flagged)
+    )
+    return 1 if flagged else 0
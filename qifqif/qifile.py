@@ -5,60 +5,187 @@
 # The MIT License http://www.opensource.org/licenses/mit-license.php
 
 try:
-    from collections import OrderedDict
-except ImportError:  # python 2.6
-    from ordereddict import OrderedDict
+    from collections.abc import MutableMapping
+except ImportError:  # python 2
+    from collections import MutableMapping
 
 from qifqif import config
 
+ATTRIBUTES = frozenset(config.FIELDS_NAMES + (u"filename",))
+_KEYS = {}  # fields layouts in file order -> interned keys order
 
-def parse_lines(lines, options=None):
-    """Return list of transactions as ordered dicts with fields save in same
-    order as they appear in input file.
+
+def _keys_order(layout):
+    """Return keys order of transactions whose fields appear in given order in
+    file: missing fields come next, then the filename.
+    """
+    try:
+        return _KEYS[layout]
+    except KeyError:
+        missing = tuple([x for x in config.FIELDS_NAMES if x not in layout])
+        res = _KEYS[layout] = layout + missing + (u"filename",)
+        return res
+
+
+class Transaction(MutableMapping):
+    """QIF transaction, with known fields stored as attributes. Unrecognized
+    lines are kept aside along with their original position, under a key
+    made of their line number, so that the original layout is preserved.
+
+    Behaves as an ordered mapping, keys being ordered like fields appear in
+    file, followed by missing fields and the filename.
+    """
+
+    __slots__ = tuple(ATTRIBUTES) + ("_keys", "_unknown")
+
+    def __init__(self, filename=u""):
+        # fields attributes are left unset until assigned and read as None
+        self.filename = filename
+        self._keys = _keys_order(())
+        self._unknown = None  # list of (position, key, line)
+
+    def __getitem__(self, key):
+        if key in ATTRIBUTES:
+            return getattr(self, key, None)
+        for (_, _key, line) in self._unknown or ():
+            if _key == key:
+                return line
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in ATTRIBUTES:
+            return getattr(self, key, None)
+        return MutableMapping.get(self, key, default)
+
+    def __setitem__(self, key, value):
+        if key in ATTRIBUTES:
+            setattr(self, key, value)
+            return
+        if self._unknown is None:
+            self._unknown = []
+        for (idx, (pos, _key, _)) in enumerate(self._unknown):
+            if _key == key:
+                self._unknown[idx] = (pos, key, value)
+                return
+        self._unknown.append((len(self), key, value))
+
+    def __delitem__(self, key):
+        """Unknown lines are removed, known fields are reset to None."""
+        if key in ATTRIBUTES:
+            setattr(self, key, None)
+            return
+        unknown = self._unknown or []
+        for (idx, (_, _key, _)) in enumerate(unknown):
+            if _key == key:
+                del unknown[idx]
+                self._unknown = [
+                    (pos - 1 if i >= idx else pos, k, line)
+                    for (i, (pos, k, line)) in enumerate(unknown)
+                ]
+                return
+        raise KeyError(key)
+
+    def __iter__(self):
+        if not self._unknown:
+            return iter(self._keys)
+        keys = list(self._keys)
+        for (pos, key, _) in self._unknown:
+            keys.insert(pos, key)
+        return iter(keys)
+
+    def __len__(self):
+        return len(self._keys) + len(self._unknown or ())
+
+    def items(self):
+        res = [(key, getattr(self, key, None)) for key in self._keys]
+        for (pos, key, line) in self._unknown or ():
+            res.insert(pos, (key, line))
+        return res
+
+    def __repr__(self):
+        return "Transaction(%r)" % list(self.items())
+
+    def copy(self):
+        res = Transaction(self.filename)
+        for field in config.FIELDS_NAMES:
+            setattr(res, field, getattr(self, field, None))
+        res._keys = self._keys
+        res._unknown = list(self._unknown) if self._unknown else None
+        return res
+
+
+def iter_transactions(lines, options=None):
+    """Yield transactions with fields saved in same order as they appear in
+    input. lines can be any iterable, including a file object, as
+    transactions are parsed one at a time.
     """
     if not options:
         options = {}
-    res = []
-    transaction = OrderedDict()
+    filename = options.get("src", "")
+    fields = config.FIELDS
+    transaction, layout, unknown = Transaction(filename), [], []
     for (idx, line) in enumerate(lines):
         line = line.strip()
         if not line:
             continue
         field_id = line[0]
         if field_id == "^":
-            if transaction:
-                res.append(transaction)
-            transaction = OrderedDict([])
-        elif field_id in list(config.FIELDS.keys()):
-            transaction[config.FIELDS[field_id]] = line[1:]
-        elif line:
-            transaction["%s" % idx] = line
-
-    if len(list(transaction.keys())):
-        res.append(transaction)
-
-    # post-check to not interfere with present keys order
-    for t in res:
-        for field in list(config.FIELDS.values()):
-            if field not in t:
-                t[field] = None
-        t[u"filename"] = options.get("src", "")
-    return res
+            if layout or unknown:
+                yield _complete(transaction, layout, unknown)
+            transaction, layout, unknown = Transaction(filename), [], []
+        elif field_id in fields:
+            field = fields[field_id]
+            if field not in layout:
+                layout.append(field)
+            setattr(transaction, field, line[1:])
+        else:
+            unknown.append((len(layout) + len(unknown), "%s" % idx, line))
 
+    if layout or unknown:
+        yield _complete(transaction, layout, unknown)
 
-def dump_to_buffer(transactions):
-    """Output transactions to file or terminal."""
-    reverse_fields = {}
-    for (key, val) in list(config.FIELDS.items()):
-        reverse_fields[val] = key
+
+def _complete(transaction, layout, unknown):
+    transaction._keys = _keys_order(tuple(layout))
+    transaction._unknown = unknown or None
+    return transaction
+
+
+def parse_lines(lines, options=None):
+    """Return list of transactions with fields saved in same order as they
+    appear in input file.
+    """
+    return list(iter_transactions(lines, options))
+
+
+def format_transaction(t):
+    """Return transaction as QIF lines, ending with the ^ delimiter."""
+    reverse_fields = config.REVERSE_FIELDS
+    extra_fields = config.EXTRA_FIELDS_NAMES
     lines = []
+    for (key, val) in t.items():
+        if val and key not in extra_fields:
+            lines.append(reverse_fields.get(key, ""))
+            lines.append(val)
+            lines.append("\n")
+    lines.append("^\n")
+    return "".join(lines)
+
+
+def write_transactions(transactions, fileobj):
+    """Write transactions to fileobj as they come. Output is the same as
+    dump_to_buffer() one. Return number of transactions written.
+    """
+    count = 0
     for t in transactions:
-        for key in t:
-            if t[key] and key not in list(config.EXTRA_FIELDS.values()):
-                try:
-                    lines.append("%s%s\n" % (reverse_fields[key], t[key]))
-                except KeyError:  # Unrecognized field
-                    lines.append(t[key] + "\n")
-        lines.append("^\n")
-    res = "".join(lines).strip() + "\n"
-    return res
+        fileobj.write(format_transaction(t))
+        count += 1
+    if not count:
+        fileobj.write(u"\n")
+    return count
+
+
+def dump_to_buffer(transactions):
+    """Output transactions to file or terminal."""
+    res = "".join([format_transaction(t) for t in transactions])
+    return res.strip() + "\n"
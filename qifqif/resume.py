@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017-2020 Fabrice Laporte - kray.me
+# The MIT License http://www.opensource.org/licenses/mit-license.php
+
+"""Checkpoints of interrupted runs, allowing the next run on the same file
+to skip transactions already processed.
+
+A checkpoint, saved next to the output file, records the number of
+processed transactions, the size and hash of the output lines holding them
+(and of the input ones when output is another file) and the hash of the
+configuration they were processed with. It is only used if files
+beginnings and the configuration are unchanged.
+"""
+
+import hashlib
+import io
+import json
+import os
+import re
+
+from qifqif.atomic import atomic_open
+
+LINE_RE = re.compile(r"[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+")
+
+
+def checkpoint_path(filepath):
+    """Return path of the checkpoint of given QIF file."""
+    return filepath + ".resume"
+
+
+def config_version(config):
+    """Return hash of config file content."""
+    sha = hashlib.sha1()
+    if os.path.isfile(config):
+        with io.open(config, "rb") as fin:
+            for chunk in iter(lambda: fin.read(2 ** 16), b""):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _prefix(filepath, count):
+    """Return a tuple (size, sha1) of the lines holding the first count
+    transactions of filepath, as written by qifile.write_transactions().
+    """
+    sha = hashlib.sha1()
+    offset, seen = 0, 0
+    with io.open(filepath, "rb") as fin:
+        for line in fin:
+            if seen == count:
+                break
+            sha.update(line)
+            offset += len(line)
+            seen += line.startswith(b"^")
+    return offset, sha.hexdigest()
+
+
+class LineReader(object):
+    """Iterator over lines of a binary file object, decoded like
+    io.TextIOWrapper does, recording offsets in bytes of the end of the
+    transactions parsed from them.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.start = self.offset = fileobj.tell()
+        self.exact = True  # False once a line ending with a lone \r is read
+        self.ends = []  # offset of the end of each transaction
+
+    def __iter__(self):
+        for line in self.fileobj:
+            self.offset += len(line)
+            pieces = LINE_RE.findall(line.decode("utf-8", "ignore"))
+            if len(pieces) > 1:
+                self.exact = False
+            for piece in pieces:
+                yield piece
+
+    def track(self, transactions):
+        """Yield transactions parsed from reader lines, as they come."""
+        for t in transactions:
+            self.ends.append(self.offset)  # parser yields once delimiter read
+            yield t
+
+    def end_of(self, count):
+        """Return offset of the end of the count-th transaction tracked, None
+        if offsets are not reliable.
+        """
+        if not self.exact:
+            return None
+        return self.ends[count - 1] if count else self.start
+
+
+def save(filepath, count, config, src=None, src_offset=None):
+    """Save checkpoint of filepath, its first count transactions being
+    processed with config from the ones of src (DEFAULT: filepath itself),
+    that end at src_offset in bytes. Without src_offset, the checkpoint can
+    only be used to process filepath in-place.
+    """
+    offset, sha = _prefix(filepath, count)
+    checkpoint = {
+        "count": count,
+        "offset": offset,
+        "sha1": sha,
+        "config": config_version(config),
+    }
+    if src is not None and src != filepath and src_offset is not None:
+        with io.open(src, "rb") as fin:
+            checkpoint["src_sha1"] = hashlib.sha1(fin.read(src_offset)).hexdigest()
+        checkpoint["src_offset"] = src_offset
+    with atomic_open(checkpoint_path(filepath)) as fout:
+        fout.write(u"%s\n" % json.dumps(checkpoint, sort_keys=True))
+
+
+def clear(filepath):
+    """Remove checkpoint of filepath, if any."""
+    if os.path.isfile(checkpoint_path(filepath)):
+        os.remove(checkpoint_path(filepath))
+
+
+def skip(filepath, fileobj, config, dest=None):
+    """Read from binary fileobj, opened on filepath, the transactions saved
+    as processed in the checkpoint of dest, the file they were written to
+    (DEFAULT: filepath itself). Return a tuple (count, text) of their number
+    and processed content. If there is no valid checkpoint, fileobj is left
+    at start and (0, u"") is returned.
+    """
+    dest = dest or filepath
+    try:
+        with io.open(checkpoint_path(dest), "r", encoding="utf-8") as fin:
+            checkpoint = json.load(fin)
+    except (IOError, OSError, ValueError):
+        return 0, u""
+    if checkpoint.get("config") != config_version(config):
+        return 0, u""
+    if dest == filepath:
+        prefix = fileobj.read(checkpoint["offset"])
+        if hashlib.sha1(prefix).hexdigest() != checkpoint["sha1"]:
+            fileobj.seek(0)
+            return 0, u""
+        return checkpoint["count"], prefix.decode("utf-8", "ignore")
+    if "src_offset" not in checkpoint or not os.path.isfile(dest):
+        return 0, u""
+    with io.open(dest, "rb") as fin:
+        prefix = fin.read(checkpoint["offset"])
+    if hashlib.sha1(prefix).hexdigest() != checkpoint["sha1"]:
+        return 0, u""
+    if hashlib.sha1(fileobj.read(checkpoint["src_offset"])).hexdigest() != (
+        checkpoint["src_sha1"]
+    ):
+        fileobj.seek(0)
+        return 0, u""
+    return checkpoint["count"], prefix.decode("utf-8", "ignore")
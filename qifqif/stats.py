@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017-2020 Fabrice Laporte - kray.me
+# The MIT License http://www.opensource.org/licenses/mit-license.php
+
+"""Timers and counters telling where processing time goes. Disabled by
+default, they cost a flag check when so.
+"""
+
+from __future__ import print_function
+
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+perf_counter = getattr(time, "perf_counter", time.time)
+
+ENABLED = False
+STAGES = ("load", "parse", "match", "save", "write")
+TIMERS = defaultdict(float)
+COUNTERS = defaultdict(int)
+RULERS = {}  # id(rule engine entry) -> [entry, evaluations, seconds]
+
+
+def enable():
+    """Reset and start collecting statistics."""
+    global ENABLED
+    ENABLED = True
+    TIMERS.clear()
+    COUNTERS.clear()
+    RULERS.clear()
+
+
+def count(name, value=1):
+    if ENABLED:
+        COUNTERS[name] += value
+
+
+@contextmanager
+def timer(stage):
+    """Add time spent in block to given stage."""
+    if not ENABLED:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        TIMERS[stage] += perf_counter() - start
+
+
+def timed_iter(iterable, stage, counter=None):
+    """Yield items of iterable, adding time spent producing them to stage."""
+    iterator = iter(iterable)
+    while True:
+        start = perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            TIMERS[stage] += perf_counter() - start
+        if counter:
+            COUNTERS[counter] += 1
+        yield item
+
+
+class TimedWriter(object):
+    """File object wrapper adding time spent writing to given stage."""
+
+    def __init__(self, fileobj, stage):
+        self.fileobj = fileobj
+        self.stage = stage
+
+    def write(self, data):
+        start = perf_counter()
+        try:
+            return self.fileobj.write(data)
+        finally:
+            TIMERS[self.stage] += perf_counter() - start
+
+
+def report(top=10):
+    """Return statistics as a dict, with the top slowest rulers."""
+    lookups = COUNTERS["matched"] + COUNTERS["missed"]
+    stages = dict((stage, TIMERS[stage]) for stage in STAGES)
+    stages["total"] = TIMERS["total"]
+    stages["other"] = max(0, stages["total"] - sum(TIMERS[x] for x in STAGES))
+    rulers = {}  # merge entries of a ruler from successive rule engine indexes
+    for (entry, evaluations, seconds) in RULERS.values():
+        tag, ruler = entry[1], entry[2]
+        stat = rulers.setdefault((tag, id(ruler)), [tag, ruler, 0, 0.0])
+        stat[2] += evaluations
+        stat[3] += seconds
+    slowest = sorted(rulers.values(), key=lambda x: -x[3])[:top]
+    return {
+        "stages": stages,
+        "counters": dict(COUNTERS),
+        "match_ratio": float(COUNTERS["matched"]) / lookups if lookups else None,
+        "slowest_rulers": [
+            {"tag": tag, "ruler": ruler, "evaluations": evals, "seconds": secs}
+            for (tag, ruler, evals, secs) in slowest
+        ],
+    }
+
+
+def print_report(stream, top=10):
+    """Print statistics in a human readable way."""
+    res = report(top)
+    print("Time per stage:", file=stream)
+    for (stage, seconds) in sorted(res["stages"].items(), key=lambda x: -x[1]):
+        print("  %-10s %9.3fs" % (stage, seconds), file=stream)
+    print("Counters:", file=stream)
+    for (name, value) in sorted(res["counters"].items()):
+        print("  %-20s %9d" % (name, value), file=stream)
+    if res["match_ratio"] is not None:
+        print("Match ratio: %.1f%%" % (100 * res["match_ratio"]), file=stream)
+    if res["slowest_rulers"]:
+        print("Slowest rulers:", file=stream)
+    for ruler in res["slowest_rulers"]:
+        print(
+            "  %9.3fs %9d  %s: %s"
+            % (
+                ruler["seconds"],
+                ruler["evaluations"],
+                ruler["tag"],
+                json.dumps(ruler["ruler"]),
+            ),
+            file=stream,
+        )
+
+
+def write_report(filepath, top=10):
+    """Write statistics to a JSON file."""
+    with open(filepath, "w") as fout:
+        json.dump(report(top), fout, indent=4, sort_keys=True)
+        fout.write("\n")
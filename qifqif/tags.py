@@ -6,13 +6,35 @@
 
 """Cache mapping categories with associated keywords"""
 
+from __future__ import print_function
+
 import json
+import marshal
 import os
 import re
+import sys
+import time
+from collections import OrderedDict, deque
+from itertools import islice
 
 from six import string_types
 
+from qifqif import stats
+from qifqif.atomic import atomic_open
+from qifqif.matching import fold, keyword_tokens, required_literal, tokenize
+
 TAGS = dict()
+VERSION = 0  # incremented each time TAGS rulers change
+ENGINE = None
+MATCHES_CACHE_SIZE = 4096
+_MATCHES = OrderedDict()  # least recently used first
+_MATCHES_VERSION = None
+_PATTERNS = {}
+RULE_BUDGET = None  # profiler.RuleBudget limiting time spent per ruler
+CACHE_FORMAT = 7  # to increment when RuleEngine.dump() data changes
+_UNSAVED_EDITS = 0
+_LAST_SAVE = time.time()
+BASIC_RULE_RE = re.compile(r"^\\b([^.^$*+?{}\[\]\\|()]+)\\b$")
 
 
 def rulify(obj):
@@ -36,33 +58,516 @@ def unrulify(ruler):
     return ruler
 
 
+def compile_rule(rule):
+    """Return case-insensitive compiled pattern for rule, or None if rule is
+    not a valid regex. Patterns are cached for the lifetime of the process.
+    """
+    try:
+        return _PATTERNS[rule]
+    except KeyError:
+        pass
+    except TypeError:  # unhashable rule
+        return None
+    try:
+        pattern = re.compile(rule, re.I)
+    except (re.error, TypeError, ValueError, OverflowError, RuntimeError):
+        # not Exception: profiler.RuleTimeout must get through
+        pattern = None
+    _PATTERNS[rule] = pattern
+    return pattern
+
+
+def rule_error(rule):
+    """Return why rule is not a valid regex, None if it is valid."""
+    if not isinstance(rule, string_types):
+        return "not a string"
+    if compile_rule(rule) is not None:
+        return None
+    try:
+        re.compile(rule, re.I)
+    except Exception as err:
+        return "%s" % err
+    return "invalid regex"
+
+
+def compile_ruler(ruler):
+    """Rulify ruler and return it as a tuple of (field, rule) pairs. Rules
+    are compiled on first use, None standing for a rule that is not a string.
+    """
+    ruler = rulify(ruler)
+    return tuple(
+        (field.lower(), rule if isinstance(rule, string_types) else None)
+        for (field, rule) in ruler.items()
+    )
+
+
+def match_compiled(rules, t):
+    """Like match() but for a ruler already compiled with compile_ruler()."""
+    res = {}
+    for (field, rule) in rules:
+        value = t.get(field)
+        m = None
+        if isinstance(value, string_types):
+            pattern = _PATTERNS.get(rule) or compile_rule(rule)
+            if pattern is not None:
+                m = pattern.search(value)
+        res[field] = m.span() if m and m.end() > m.start() else None
+    return all([x for x in list(res.values())]), res
+
+
 def match(ruler, t):
     """Return a tuple (match, dict) indicating if transaction matches ruler.
-    match is a bool, while dict contains matching values for ruler fields.
+    match is a bool, while dict contains (start, end) spans of matching values
+    for ruler fields, None for fields not matched or matched by an empty string.
+    """
+    return match_compiled(compile_ruler(ruler), t)
+
+
+def basic_words(ruler):
+    """Return the folded words a basic ruler is made of, as a tuple. None for
+    any other ruler, or if payee words matched by ruler are not these words.
     """
-    res = {}
     ruler = rulify(ruler)
-    for field in ruler.keys():
-        rule = ruler[field]
-        field = field.lower()
+    if list(ruler.keys()) != ["PAYEE"]:
+        return None
+    m = BASIC_RULE_RE.match("%s" % ruler["PAYEE"])
+    words = keyword_tokens(m.group(1)) if m else None
+    return tuple(words) if words else None
+
+
+def ruler_literal(rules):
+    """Return a (field, literal) tuple such that rules can only match a
+    transaction whose folded field value contains literal. None if rules
+    have no required literal.
+    """
+    res = None
+    for (field, rule) in dict(rules).items():  # last rule of a field prevails
+        literal = required_literal(rule)
+        if literal and (res is None or len(literal) > len(res[1])):
+            res = (field, literal)
+    return res
+
+
+class RuleEngine(object):
+    """Rulers of a tags dictionary, compiled once and kept in sync with it
+    category by category. Rulers having invalid rules, that can't match, are
+    set aside in `invalid` dict.
+
+    Basic rulers are indexed by the sequence of words they are made of, and
+    looked up all at once from payee words. Other rulers are tried one by
+    one. The latter are grouped by the fields they look at, so that rulers
+    looking at fields a transaction has no value for, which can't match, are
+    skipped. Rulers whose regexes require a literal are skipped too when the
+    field doesn't contain it.
+    """
+
+    def __init__(self, tags):
+        self.tags = tags
+        self.rulers = {}
+        self.invalid = {}  # tag -> list of (ruler, [(field, error)])
+        self.ranks = None  # tag -> rank, increasing along tags dictionary
+        self._next_rank = 0
+        self.index = None  # words tuple -> basic rulers entries
+        self.lengths = None  # words tuple length -> number of indexed entries
+        self.groups = None  # fields -> linear scan entries
+        self._linear = None  # present fields -> linear scan entries
+        self.entries = None
+        self.fields = None
+        for tag in tags:
+            self._compile(tag)
+
+    def update(self, tag):
+        """Recompile rulers of given tag after it has been edited. Index is
+        updated in place.
+        """
+        self._compile(tag)
+        if self.index is not None:
+            self._unplace(tag)
+            self._place(tag)
+            self.entries.sort(key=lambda x: x[0])
+
+    def _compile(self, tag):
+        self.rulers.pop(tag, None)
+        self.invalid.pop(tag, None)
+        if tag not in self.tags:
+            return
+        self.rulers[tag] = []
+        for ruler in self.tags[tag]:
+            if not ruler or not isinstance(ruler, (dict,) + string_types):
+                error = (None, "not a string or dict")
+                self.invalid.setdefault(tag, []).append((ruler, [error]))
+                continue
+            rules = compile_ruler(ruler)
+            errors = [(field, rule_error(rule)) for (field, rule) in rules]
+            errors = [(field, err) for (field, err) in errors if err]
+            if errors:
+                self.invalid.setdefault(tag, []).append((ruler, errors))
+            else:
+                self.rulers[tag].append((ruler, rules))
+
+    def build_index(self):
+        """Dispatch rulers between words index and linear scan groups."""
+        self.ranks, self._next_rank = {}, 0
+        self.index, self.lengths, self.groups, self._linear = {}, {}, {}, {}
+        self.entries, self.fields = [], ()
+        for tag in self.tags:
+            if tag not in self.rulers:
+                self._compile(tag)
+            self._place(tag)
+
+    def _place(self, tag):
+        """Add entries of tag rulers to index or linear scan groups. Entries
+        are tagged with their position in tags dictionary so that candidates
+        can be yielded in the same order whatever their origin.
+        """
+        self._linear = {}
+        if tag not in self.tags:
+            self.ranks.pop(tag, None)
+            return
+        if tag not in self.ranks:  # new tags come last in dictionary
+            self.ranks[tag] = self._next_rank
+            self._next_rank += 1
+        fields = set(self.fields)
+        for (ruler_idx, (ruler, rules)) in enumerate(self.rulers[tag]):
+            words = basic_words(ruler)
+            literal = None if words else ruler_literal(rules)
+            entry = ((self.ranks[tag], ruler_idx), tag, ruler, rules, literal)
+            self._add(entry, words)
+            fields.update(field for (field, _) in rules)
+        self.fields = tuple(sorted(fields))
+
+    def _add(self, entry, words):
+        """Add entry to index if words is not None, else to linear groups."""
+        self.entries.append(entry)
+        if words:
+            self.index.setdefault(words, []).append(entry)
+            self.lengths[len(words)] = self.lengths.get(len(words), 0) + 1
+        else:
+            group = frozenset(field for (field, _) in entry[3])
+            self.groups.setdefault(group, []).append(entry)
+
+    def dump(self):
+        """Return engine state as plain data, serializable with marshal."""
+        if self.index is None:
+            self.build_index()
+        words = {}
+        for (key, entries) in self.index.items():
+            for entry in entries:
+                words[id(entry)] = key
+        return {
+            "tags": self.tags,
+            "invalid": self.invalid,
+            "ranks": self.ranks,
+            "next_rank": self._next_rank,
+            "entries": [entry + (words.get(id(entry)),) for entry in self.entries],
+        }
+
+    @classmethod
+    def restore(cls, data):
+        """Return rule engine from dump() data, rulers being neither compiled
+        nor indexed again.
+        """
+        engine = cls({})
+        engine.tags, engine.invalid = data["tags"], data["invalid"]
+        engine.ranks, engine._next_rank = data["ranks"], data["next_rank"]
+        engine.index, engine.lengths, engine.groups, engine._linear = {}, {}, {}, {}
+        engine.entries = []
+        engine.rulers = dict((tag, []) for tag in engine.tags)
+        fields = set()
+        for (rank, tag, ruler, rules, literal, words) in data["entries"]:
+            engine._add((rank, tag, ruler, rules, literal), words)
+            engine.rulers[tag].append((ruler, rules))
+            fields.update(field for (field, _) in rules)
+        engine.fields = tuple(sorted(fields))
+        return engine
+
+    def _unplace(self, tag):
+        """Remove entries of tag rulers from index and linear scan groups."""
+        entries = [entry for entry in self.entries if entry[1] == tag]
+        if not entries:
+            return
+        self.entries = [entry for entry in self.entries if entry[1] != tag]
+        for entry in entries:
+            words = basic_words(entry[2])
+            if words:
+                container, key = self.index, words
+                self.lengths[len(words)] -= 1
+                if not self.lengths[len(words)]:
+                    del self.lengths[len(words)]
+            else:
+                container = self.groups
+                key = frozenset(field for (field, _) in entry[3])
+            container[key].remove(entry)
+            if not container[key]:
+                del container[key]
+
+    def cache_key(self, t):
+        """Return values of t fields that rulers look at."""
+        if self.index is None:
+            self.build_index()
+        return tuple(t.get(field) for field in self.fields)
+
+    def linear(self, present):
+        """Return linear scan entries of rulers looking only at present
+        fields, in tags dictionary order.
+        """
         try:
-            m = re.search(rule, t[field], re.I)
-            res[field] = t[field][m.start() : m.end()] if m else None
-        except Exception:
-            res[field] = None
-    return all([x for x in list(res.values())]), res
+            return self._linear[present]
+        except KeyError:
+            pass
+        res = []
+        for (fields, entries) in self.groups.items():
+            if fields <= present:
+                res.extend(entries)
+        res.sort(key=lambda x: x[0])
+        self._linear[present] = res
+        return res
+
+    def candidates(self, t):
+        """Return rulers that may match t, in tags dictionary order. Fields
+        with no value or an empty one can't be matched by a rule.
+        """
+        if self.index is None:
+            self.build_index()
+        folded = {}
+        for field in self.fields:
+            value = t.get(field)
+            if value and isinstance(value, string_types):
+                folded[field] = fold(value)
+        res = [
+            entry
+            for entry in self.linear(frozenset(folded))
+            if entry[4] is None or entry[4][1] in folded[entry[4][0]]
+        ]
+        if not self.index or "payee" not in folded:
+            return res
+        found = self.index_candidates(t.get("payee"))
+        if not found:
+            return res
+        return sorted(res + found, key=lambda x: x[0])
+
+    def index_candidates(self, payee):
+        """Return indexed basic rulers entries whose words appear in payee,
+        in no particular order.
+        """
+        words = tokenize(payee)
+        found = {}
+        for length in self.lengths:
+            for idx in range(len(words) - length + 1):
+                for entry in self.index.get(tuple(words[idx : idx + length]), ()):
+                    found[entry[0]] = entry
+        return list(found.values())
+
+    def iter_matches(self, t):
+        """Yield (tag, ruler, matches) tuples for all rulers matching t, in
+        tags dictionary order.
+        """
+        if stats.ENABLED or RULE_BUDGET is not None:
+            for res in self._iter_matches_checked(t):
+                yield res
+            return
+        for (_, tag, ruler, rules, _) in self.candidates(t):
+            m, matches = match_compiled(rules, t)
+            if m:
+                yield tag, ruler, matches
+
+    def _iter_matches_checked(self, t):
+        """Like iter_matches() but enforcing RULE_BUDGET and recording rulers
+        statistics, if enabled.
+        """
+        budget, timed = RULE_BUDGET, stats.ENABLED
+        perf_counter, rulers = stats.perf_counter, stats.RULERS
+        missing = [f for f in self.fields if not isinstance(t.get(f), string_types)]
+        evaluations = regexes = 0
+        res = []
+        if budget is not None:
+            budget.arm()  # alarms only while rulers are evaluated
+        try:
+            for entry in self.candidates(t):
+                start = perf_counter() if timed else 0
+                if budget is None:
+                    m, matches = match_compiled(entry[3], t)
+                else:
+                    m, matches = budget.match(entry, t)
+                if timed:
+                    elapsed = perf_counter() - start
+                    try:
+                        stat = rulers[id(entry)]
+                    except KeyError:
+                        stat = rulers[id(entry)] = [entry, 0, 0.0]
+                    stat[1] += 1
+                    stat[2] += elapsed
+                    evaluations += 1
+                    if missing:
+                        regexes += sum(1 for (f, _) in entry[3] if f not in missing)
+                    else:
+                        regexes += len(entry[3])
+                if m:
+                    res.append((entry[1], entry[2], matches))
+        finally:
+            if budget is not None:
+                budget.disarm()
+        if timed:
+            stats.COUNTERS["ruler_evaluations"] += evaluations
+            stats.COUNTERS["regex_evaluations"] += regexes
+        for match in res:
+            yield match
+
+
+def report_invalid(engine, stream=None):
+    """Print rulers of engine set aside because of invalid rules."""
+    for (tag, rulers) in sorted(engine.invalid.items()):
+        for (ruler, errors) in rulers:
+            print(
+                "Ignoring ruler %s of category '%s': %s"
+                % (
+                    json.dumps(ruler),
+                    tag,
+                    ", ".join(
+                        "%s rule %s" % (f, err) if f else err for (f, err) in errors
+                    ),
+                ),
+                file=stream or sys.stderr,
+            )
+
+
+def get_engine():
+    """Return rule engine for current TAGS, building it if TAGS changed."""
+    global ENGINE, VERSION
+    if ENGINE is None or ENGINE.tags is not TAGS:
+        ENGINE = RuleEngine(TAGS)
+        VERSION += 1
+    return ENGINE
 
 
 def find_tag_for(t):
     """If transaction matches a rule, returns corresponding tuple
     (tag, ruler, match).
+    Results are memoized on the values of the fields looked at by rulers, as
+    a transaction gets matched several times while processed.
+    """
+    engine = get_engine()
+    _check_matches()
+    key = engine.cache_key(t)
+    stats.count("lookups")
+    try:
+        res = _MATCHES.pop(key)
+        stats.count("lookup_cache_hits")
+    except KeyError:
+        with stats.timer("match"):
+            res = _find_tag_for(engine, t)
+    except TypeError:  # unhashable field value
+        with stats.timer("match"):
+            return _find_tag_for(engine, t)
+    _memoize(key, res)
+    return res
+
+
+def remember(key, res, version):
+    """Memoize res as find_tag_for result for transactions with given cache
+    key, res having been computed elsewhere against TAGS at given VERSION.
+    """
+    if version != VERSION:
+        return
+    _check_matches()
+    try:
+        _MATCHES.pop(key, None)
+    except TypeError:  # unhashable field value
+        return
+    _memoize(key, res)
+
+
+class Prefetcher(object):
+    """Iterator over transactions whose find_tag_for() results are computed
+    ahead, by chunks, by subclasses _prefetch() method. Transactions are
+    yielded in their original order, results being handed to remember() just
+    before.
+
+    Results are only valid for rulers they were computed with: as soon as
+    TAGS is edited, prefetching stops and remaining transactions are yielded
+    as is, to be matched by the caller.
+    """
+
+    def __init__(self, transactions, chunk_size):
+        self.source = iter(transactions)
+        self.chunk_size = chunk_size
+        self.engine = get_engine()
+        if self.engine.index is None:
+            self.engine.build_index()
+        self.version = VERSION  # None once prefetching stopped
+        self.ready = deque()  # (transaction, key, result) tuples
+
+    def __iter__(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __next__(self):
+        if not self.ready:
+            self._fill()
+        if not self.ready:
+            self.close()
+            raise StopIteration
+        t, key, res = self.ready.popleft()
+        if res is not None:
+            remember(key, res, self.version)
+        return t
+
+    next = __next__  # python 2
+
+    def close(self):
+        """Release resources used for prefetching."""
+
+    def stop(self):
+        """Stop prefetching, remaining transactions being yielded as is."""
+        self.version = None
+
+    def _fill(self):
+        if self.version is not None and self.version != VERSION:
+            self.stop()
+        if self.version is not None:
+            self._prefetch()
+        else:
+            self.ready.extend((t, None, None) for t in self._chunk())
+
+    def _chunk(self):
+        """Return next chunk of transactions to process."""
+        return list(islice(self.source, self.chunk_size))
+
+    def _prefetch(self):
+        """Extend self.ready with next transactions and their results."""
+        raise NotImplementedError
+
+
+def _check_matches():
+    """Forget memoized results once TAGS rulers changed."""
+    global _MATCHES_VERSION
+    if _MATCHES_VERSION != VERSION:
+        _MATCHES.clear()
+        _MATCHES_VERSION = VERSION
+
+
+def _memoize(key, res):
+    """Memoize res as most recently used result, evicting the least recently
+    used ones beyond MATCHES_CACHE_SIZE.
+    """
+    _MATCHES[key] = res
+    while len(_MATCHES) > max(MATCHES_CACHE_SIZE, 0):
+        _MATCHES.popitem(last=False)
+
+
+def _find_tag_for(engine, t):
+    return best_match(list(engine.iter_matches(t)))
+
+
+def best_match(res):
+    """Return best of (tag, ruler, matches) tuples of rulers matching a
+    transaction, in tags dictionary order. (None, None, None) if empty.
     """
-    res = []
-    for (tag, rulers) in list(TAGS.items()):
-        for ruler in rulers:
-            m, matches = match(ruler, t)
-            if m:
-                res.append((tag, ruler, matches))
     if res:
         # Return rule with the most fields.
         # If several, pick the ont with the longer rules.
@@ -70,7 +575,7 @@ def find_tag_for(t):
             res,
             key=lambda tag_ruler_matches: (
                 len(list(rulify(tag_ruler_matches[1]).keys())),
-                sum([len(v) for v in list(tag_ruler_matches[2].values()) if v]),
+                sum([v[1] - v[0] for v in tag_ruler_matches[2].values() if v]),
             ),
         )
     return None, None, None
@@ -85,16 +590,69 @@ def convert(tags):
     return tags
 
 
-def load(filepath):
-    """Load tags dictionary."""
-    global TAGS
+def cache_path(filepath):
+    """Return path of the rule engine cache of given config file."""
+    return filepath + ".cache"
+
+
+def _cache_key(filepath):
+    stat = os.stat(filepath)
+    mtime = getattr(stat, "st_mtime_ns", stat.st_mtime)
+    return (CACHE_FORMAT, tuple(sys.version_info[:2]), stat.st_size, mtime)
+
+
+def load_cache(filepath):
+    """Return rule engine cached for config file, None if cache is missing,
+    outdated or not owned by current user. The cache only holds data, no
+    object gets unpickled from it.
+    """
+    path = cache_path(filepath)
+    try:
+        if hasattr(os, "getuid") and os.stat(path).st_uid != os.getuid():
+            return None
+        with open(path, "rb") as cache:
+            key, data = marshal.load(cache)
+        if key != _cache_key(filepath):
+            return None
+        return RuleEngine.restore(data)
+    except Exception:
+        return None
+
+
+def save_cache(filepath, engine):
+    """Cache rule engine built from config file, if possible."""
+    key = _cache_key(filepath)
+    try:
+        data = marshal.dumps((key, engine.dump()))
+        with atomic_open(cache_path(filepath), encoding=None) as cache:
+            cache.write(data)
+    except (IOError, OSError, ValueError):  # read-only directory, unusual rulers
+        pass
+
+
+def load(filepath, cache=True):
+    """Load tags dictionary. If cache is True, the rule engine is loaded
+    from, or saved to, a cache file next to the config file, so that rulers
+    are not converted and indexed again as long as config is not modified.
+    """
+    global TAGS, ENGINE, VERSION, _UNSAVED_EDITS, _LAST_SAVE
+    _UNSAVED_EDITS, _LAST_SAVE = 0, time.time()
     if os.path.isfile(filepath):
+        engine = load_cache(filepath) if cache else None
+        if engine is not None:
+            TAGS, ENGINE = engine.tags, engine
+            VERSION += 1
+            report_invalid(engine)
+            return TAGS
         with open(filepath, "r") as cfg:
             try:
                 TAGS = json.load(cfg)
             except Exception as err:
                 print("Error loading '%s'.\n%s" % (filepath, err))
                 exit(1)
+        report_invalid(get_engine())
+        if cache:
+            save_cache(filepath, get_engine())
     else:
         TAGS = {}
     return TAGS
@@ -105,36 +663,79 @@ def prettify(tags):
     return json.dumps(tags, sort_keys=True, indent=4, separators=(",", ": ")) + "\n"
 
 
-def save(filepath, tags):
-    """Save tags dictionary on disk"""
-    with open(filepath, "w+") as cfg:
-        cfg.write(prettify(tags))
+def save(filepath, tags, backups=0):
+    """Save tags dictionary on disk, keeping given number of backups of the
+    previous versions.
+    """
+    global _UNSAVED_EDITS, _LAST_SAVE
+    stats.count("saves")
+    with stats.timer("save"), atomic_open(filepath, backups) as cfg:
+        cfg.write(u"%s" % prettify(tags))
+    _UNSAVED_EDITS, _LAST_SAVE = 0, time.time()
+
+
+def flush(filepath, backups=0):
+    """Save TAGS on disk if it has edits not saved yet."""
+    if _UNSAVED_EDITS:
+        save(filepath, TAGS, backups)
+
+
+def mark_edited(options):
+    """Record an edit of TAGS and save the latter if due."""
+    global _UNSAVED_EDITS
+    _UNSAVED_EDITS += 1
+    save_if_due(options)
+
+
+def save_if_due(options):
+    """Save TAGS edits not saved yet once options thresholds are reached:
+    "save-every" edits (0 to disable) or "save-interval" seconds since last
+    save (0 to disable).
+    """
+    if not _UNSAVED_EDITS or options.get("dry-run"):
+        return
+    every = options.get("save-every", 1)
+    interval = options.get("save-interval", 0)
+    if (every and _UNSAVED_EDITS >= every) or (
+        interval and time.time() - _LAST_SAVE >= interval
+    ):
+        flush(options["config"], options.get("backups", 0))
 
 
 def edit(t, tag, _match, options=None):
     """Save a tag modification into dictionary and save the latter on file."""
+    global VERSION
     if not options:
         options = {}
     _match = unrulify(_match)
     cached_tag, cached_match, _ = find_tag_for(t)
+    removed = appended = False
     if tag != cached_tag:
         if cached_tag:
             TAGS[cached_tag].remove(cached_match)
             if not TAGS[cached_tag]:
                 del TAGS[cached_tag]
+            removed = True
         if tag and _match:
             if tag not in TAGS:
                 TAGS[tag] = [_match]
             else:
                 TAGS[tag].append(_match)
+            appended = True
     elif _match is not None and _match != cached_match:
         if cached_match:
             TAGS[tag].remove(cached_match)
+            removed = True
         if tag and _match:
             TAGS[tag].append(_match)
-    else:  # no diff
+            appended = True
+    if not (removed or appended):  # no diff
         return
+    engine = get_engine()
+    for edited_tag in set([tag, cached_tag]):
+        engine.update(edited_tag)
+    VERSION += 1
 
     if not options.get("dry-run", False):
-        save(options["config"], TAGS)
+        mark_edited(options)
     return TAGS
@@ -42,8 +42,26 @@ class Terminus(object):
         yield None
 
 
-try:
-    from blessed import Terminal as BlessedTerminal
+def load_terminal():
+    """Return a blessed terminal, or a Terminus if blessed is not installed."""
+    try:
+        from blessed import Terminal as BlessedTerminal
+    except ImportError:
+        if sys.platform == "win32":
+            import codecs
+
+            codecs.register(
+                lambda name: codecs.lookup("utf-8") if name == "cp65001" else None
+            )
+
+            # use colorama to support "ANSI" terminal colors.
+            try:
+                import colorama
+            except ImportError:
+                pass
+            else:
+                colorama.init()
+        return Terminus()
 
     class Terminal(BlessedTerminal):
         OK = u"✔"
@@ -57,22 +75,22 @@ try:
         def undo(self):
             return 2 * self.clear
 
-    TERM = Terminal()
+    return Terminal()
 
-except ImportError:
-    TERM = Terminus()
 
-    if sys.platform == "win32":
-        import codecs
+class LazyTerminal(object):
+    """Proxy to the terminal, created on first use only: importing blessed
+    and querying terminal capabilities is costly and not needed when nothing
+    gets printed.
+    """
 
-        codecs.register(
-            lambda name: codecs.lookup("utf-8") if name == "cp65001" else None
-        )
+    def __init__(self):
+        self._term = None
 
-        # use colorama to support "ANSI" terminal colors.
-        try:
-            import colorama
-        except ImportError:
-            pass
-        else:
-            colorama.init()
+    def __getattr__(self, name):
+        if self._term is None:
+            self._term = load_terminal()
+        return getattr(self._term, name)
+
+
+TERM = LazyTerminal()
@@ -6,33 +6,45 @@
 
 """Utilities functions related to terminal display."""
 
-from difflib import SequenceMatcher
-from itertools import chain, combinations
+import sys
 
 from qifqif.terminal import TERM
 
+MAX_COMPLETIONS = 500
+
 
 def colorize_match(t, field, matches=None):
+    """Return t field value with the part matched by the ruler highlighted,
+    matches being the dict of (start, end) spans returned by tags.match().
+    Highlighting is skipped when output is not a terminal.
+    """
     field_val = t[field]
     if not field_val:
         return None
-    match = matches.get(field, "") if matches else ""
-    seqmatch = SequenceMatcher(None, field_val, match)
-    a, b, size = seqmatch.find_longest_match(0, len(field_val), 0, len(match))
-    return field_val[:a] + TERM.green(field_val[a : a + size]) + field_val[a + size :]
+    span = matches.get(field) if matches else None
+    if not span or not sys.stdout.isatty():
+        return field_val
+    (start, end) = span
+    return field_val[:start] + TERM.green(field_val[start:end]) + field_val[end:]
 
 
-def complete_matches(payee):
-    """Generate a limited set of matches for payee line.
+def complete_matches(payee, limit=MAX_COMPLETIONS):
+    """Generate a limited set of matches for payee line: runs of consecutive
+    words, shortest first, at most limit of them.
 
     >>> complete_matches("foo bar spam")
-    ['foo', 'bar', 'spam', 'foo bar spam', 'bar spam', 'spam']
+    ['foo', 'bar', 'spam', 'foo bar', 'bar spam', 'foo bar spam']
     """
     matches = []
+    seen = set()
     tokens = payee.split()
-    sublists = chain(*(combinations(tokens, i) for i in range(len(tokens) + 1)))
-    for x in sublists:
-        match = " ".join(x)
-        if match and (match in payee):
+    for size in range(1, len(tokens) + 1):
+        for start in range(len(tokens) - size + 1):
+            match = " ".join(tokens[start : start + size])
+            if match in seen or match not in payee:  # not separated by 1 space
+                continue
+            if len(matches) == limit:
+                return matches
+            seen.add(match)
             matches.append(match)
     return matches
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""Units tests for atomic.py"""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from qifqif import atomic
+
+
+class TestAtomic(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "config.json")
+        with io.open(self.path, "w", encoding="utf-8") as fout:
+            fout.write(u"v0")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read(self, path):
+        with io.open(path, "r", encoding="utf-8") as fin:
+            return fin.read()
+
+    def test_atomic_open__error_keeps_original(self):
+        with self.assertRaises(KeyboardInterrupt):
+            with atomic.atomic_open(self.path) as fout:
+                fout.write(u"partial")
+                raise KeyboardInterrupt
+        self.assertEqual(self.read(self.path), "v0")
+        self.assertEqual(os.listdir(self.tmpdir), ["config.json"])
+
+    def test_atomic_open__rolling_backups(self):
+        for version in ("v1", "v2", "v3"):
+            with atomic.atomic_open(self.path, backups=2) as fout:
+                fout.write(u"%s" % version)
+        self.assertEqual(self.read(self.path), "v3")
+        self.assertEqual(self.read(atomic.backup_name(self.path, 1)), "v2")
+        self.assertEqual(self.read(atomic.backup_name(self.path, 2)), "v1")
+        self.assertEqual(len(os.listdir(self.tmpdir)), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
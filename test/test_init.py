@@ -2,6 +2,11 @@
 
 """Units tests for __init__.py"""
 
+import io
+import json
+import os
+import shutil
+import tempfile
 import unittest
 
 try:
@@ -10,7 +15,7 @@ except ImportError:
     import unittest.mock.patch as patch  # py3
 
 import qifqif
-from qifqif import qifile
+from qifqif import qifile, parallel, tags
 import testdata
 
 OPTIONS = qifqif.parse_args(["qifqif", "-d", "-c", testdata.CFG_FILE, "dummy"])
@@ -43,6 +48,27 @@ class TestInit(unittest.TestCase):
         res = qifile.dump_to_buffer(transactions)
         self.assertEqual(res, "".join(lines))
 
+    def test_transaction_layout(self):
+        lines = ["!Type:Bank", "PFoo", "XBar", "D01/01/2020", "^"]
+        t = qifile.parse_lines(lines, options={"src": "foo.qif"})[0]
+        self.assertEqual(list(t.keys())[:4], ["0", "payee", "2", "date"])
+        self.assertEqual((t["2"], t["memo"]), ("XBar", None))
+        self.assertEqual(t["filename"], "foo.qif")
+        t["category"] = "Bars"
+        self.assertEqual(
+            qifile.dump_to_buffer([t]),
+            "!Type:Bank\nPFoo\nXBar\nD01/01/2020\nLBars\n^\n",
+        )
+
+    def test_write_transactions(self):
+        transactions, lines = testdata.transactions()
+        with io.open(testdata.QIF_FILE, "r", encoding="utf-8") as fin:
+            streamed = list(qifile.iter_transactions(fin))
+        self.assertEqual(streamed, transactions)
+        buf = io.StringIO()
+        self.assertEqual(qifile.write_transactions(iter(streamed), buf), 2)
+        self.assertEqual(buf.getvalue(), qifile.dump_to_buffer(transactions))
+
 
 class TestInitWithConfig(unittest.TestCase):
     def setUp(self):
@@ -55,6 +81,16 @@ class TestInitWithConfig(unittest.TestCase):
         self.assertEqual(len(res), 2)
         self.assertEqual(res[0]["category"], "Bars")
 
+    def test_match_prefetcher(self):
+        transactions = testdata.transactions()[0] * 100
+        expected = [tags.find_tag_for(t) for t in transactions]
+        tags._MATCHES.clear()
+        with parallel.MatchPrefetcher(transactions, 2, chunk_size=16) as res:
+            for (t, t_res) in zip(res, transactions):
+                self.assertTrue(t is t_res)
+                key = tags.get_engine().cache_key(t)
+                self.assertEqual(tags._MATCHES[key], expected.pop(0))
+
     @patch(
         "sys.argv", ["qifqif", "-c", testdata.CFG_FILE, "-b", "-d", testdata.QIF_FILE]
     )
@@ -62,6 +98,127 @@ class TestInitWithConfig(unittest.TestCase):
         res = qifqif.main()
         self.assertEqual(res, 0)
 
+    def test_main_several_files(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for name in ("a.qif", "b.qif"):
+                shutil.copy(testdata.QIF_FILE, os.path.join(tmpdir, name))
+            os.mkdir(os.path.join(tmpdir, "out"))
+            argv = ["qifqif", "-c", testdata.CFG_FILE, "-b", "-o"]
+            argv += [os.path.join(tmpdir, "out"), os.path.join(tmpdir, "*.qif")]
+            with patch("sys.stdout", new_callable=io.StringIO):
+                self.assertEqual(qifqif.main(argv), 0)
+            for name in ("a.qif", "b.qif"):
+                with io.open(os.path.join(tmpdir, "out", name), encoding="utf-8") as f:
+                    res = qifile.parse_lines(f.readlines())
+                self.assertEqual(res[0]["category"], "Bars")
+            os.mkdir(os.path.join(tmpdir, "sub"))
+            shutil.copy(testdata.QIF_FILE, os.path.join(tmpdir, "sub", "a.qif"))
+            argv += [os.path.join(tmpdir, "sub", "a.qif")]
+            with patch("sys.stderr", new_callable=io.StringIO):
+                self.assertRaises(SystemExit, qifqif.main, argv)  # same output
+        finally:
+            shutil.rmtree(tmpdir)
+
+    @patch("qifqif.stats.ENABLED", False)
+    def run_stats(self, *args):
+        fd, filepath = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            argv = ["qifqif", "-c", testdata.CFG_FILE, "-b", "-d"] + list(args)
+            argv += ["--stats-json", filepath, testdata.QIF_FILE]
+            with patch("sys.stdout", new_callable=io.StringIO):
+                self.assertEqual(qifqif.main(argv), 0)
+            with open(filepath) as f:
+                return json.load(f)
+        finally:
+            os.remove(filepath)
+
+    def test_main_stats(self):
+        res = self.run_stats()
+        self.assertEqual(res["counters"]["transactions"], 2)
+        self.assertEqual(res["counters"]["matched"], 1)  # other one has category
+        self.assertEqual(res["match_ratio"], 1.0)
+        self.assertTrue(res["counters"]["ruler_evaluations"] > 0)
+        self.assertTrue(res["counters"]["regex_evaluations"] > 0)
+        self.assertTrue(res["slowest_rulers"][0]["tag"] in tags.TAGS)
+        self.assertTrue(res["stages"]["total"] >= res["stages"]["parse"])
+
+    def test_main_stats__columnar(self):
+        res = self.run_stats("--engine", "columnar")
+        self.assertTrue(res["counters"]["ruler_evaluations"] > 0)
+        self.assertTrue(res["counters"]["regex_evaluations"] > 0)
+
+    @patch("qifqif.terminal.TERM._term", None)
+    @patch("qifqif.terminal.load_terminal")
+    def test_main_quiet(self, load_terminal):
+        argv = ["qifqif", "-c", testdata.CFG_FILE, "-b", "-d", "-q", testdata.QIF_FILE]
+        with patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            with patch("sys.stderr", new_callable=io.StringIO) as stderr:
+                self.assertEqual(qifqif.main(argv), 0)
+        res = qifile.parse_lines(stdout.getvalue().splitlines(True))
+        self.assertEqual([t["category"] for t in res], ["Bars", "Restaurant"])
+        summary = "2/2 transactions processed, 2 categorized"
+        self.assertTrue(summary in stderr.getvalue())
+        self.assertFalse(load_terminal.called)  # nothing rendered
+
+    def check_resume(self, output=False):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            qif = os.path.join(tmpdir, "a.qif")
+            cfg = os.path.join(tmpdir, "config.json")
+            shutil.copy(testdata.QIF_FILE, qif)
+            shutil.copy(testdata.CFG_FILE, cfg)
+            argv = ["qifqif", "-c", cfg, "-b", "--resume", qif]
+            out = qif
+            if output:
+                out = os.path.join(tmpdir, "out.qif")
+                argv += ["-o", out]
+            calls = []
+
+            def interrupt_second(t, options):
+                calls.append(t["payee"])
+                if len(calls) == 2:
+                    raise KeyboardInterrupt
+                return process_transaction(t, options)
+
+            process_transaction = qifqif.process_transaction
+            with patch("sys.stdout", new_callable=io.StringIO):
+                with patch("qifqif.process_transaction", interrupt_second):
+                    self.assertEqual(qifqif.main(argv), 1)
+                self.assertTrue(os.path.exists(out + ".resume"))
+                with patch("qifqif.process_transaction", interrupt_second):
+                    self.assertEqual(qifqif.main(argv), 0)
+            self.assertEqual(calls[1:], ["CARTE 16/02/2014 L Abri"] * 2)
+            self.assertFalse(os.path.exists(out + ".resume"))
+            with io.open(out, encoding="utf-8") as f:
+                res = qifile.parse_lines(f.readlines())
+            self.assertEqual([t["category"] for t in res], ["Bars", "Restaurant"])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_main_resume(self):
+        self.check_resume()
+
+    def test_main_resume__output(self):
+        self.check_resume(output=True)
+
+    def test_main_interrupted_without_resume(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            qif = os.path.join(tmpdir, "a.qif")
+            cfg = os.path.join(tmpdir, "config.json")
+            shutil.copy(testdata.QIF_FILE, qif)
+            shutil.copy(testdata.CFG_FILE, cfg)
+            argv = ["qifqif", "-c", cfg, "-b", "-q", "-o"]
+            argv += [os.path.join(tmpdir, "out.qif"), qif]
+            with patch("qifqif.process_transaction", side_effect=KeyboardInterrupt):
+                with patch("sys.stderr", new_callable=io.StringIO):
+                    self.assertEqual(qifqif.main(argv), 1)
+            self.assertFalse(os.path.exists(os.path.join(tmpdir, "out.qif.resume")))
+        finally:
+            shutil.rmtree(tmpdir)
+
 
 if __name__ == "__main__":
     unittest.main()
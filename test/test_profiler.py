@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""Units tests for profiler.py"""
+
+import io
+import signal
+import unittest
+
+try:
+    from mock import patch  # py2
+except ImportError:
+    from unittest.mock import patch  # py3
+
+import qifqif
+from qifqif import profiler, tags
+import testdata
+
+SLOW_TAGS = {"Bars": ["Sully"], "Slow": [{"payee": "(a|aa)+$"}]}
+SLOW_TRANSACTION = {"payee": "a" * 40 + "b"}
+
+
+@unittest.skipUnless(profiler.RuleBudget.supported(), "needs signal.setitimer")
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        tags.TAGS = dict(SLOW_TAGS)
+
+    def tearDown(self):
+        tags.RULE_BUDGET = None
+
+    def test_profile__budget_quarantines_slow_ruler(self):
+        transactions = [SLOW_TRANSACTION, testdata.TRANSACTION] * 2
+        with profiler.RuleBudget(0.02, stream=io.StringIO()) as budget:
+            res = profiler.profile(transactions, budget)
+        res = dict((prof[0], prof[2:]) for prof in res)
+        self.assertEqual(res["Bars"][0], 4)
+        self.assertEqual(res["Slow"][0], 1)  # not evaluated once timed out
+        self.assertTrue(res["Slow"][3])
+
+    def test_find_tag_for__budget(self):
+        tags.RULE_BUDGET = profiler.RuleBudget(0.02, stream=io.StringIO())
+        with tags.RULE_BUDGET:
+            self.assertEqual(tags.find_tag_for(SLOW_TRANSACTION)[0], None)
+            self.assertEqual(tags.find_tag_for(testdata.TRANSACTION)[0], "Bars")
+
+    def test_find_tag_for__budget_disarmed_after_matching(self):
+        tags.RULE_BUDGET = profiler.RuleBudget(0.02, stream=io.StringIO())
+        with tags.RULE_BUDGET:
+            self.assertEqual(signal.getitimer(signal.ITIMER_REAL), (0.0, 0.0))
+            tags.find_tag_for(testdata.TRANSACTION)
+            self.assertEqual(signal.getitimer(signal.ITIMER_REAL), (0.0, 0.0))
+
+    def test_budget__timeout_while_compiling(self):
+        budget = profiler.RuleBudget(0.02, stream=io.StringIO())
+        entry = (None, "Slow", SLOW_TAGS["Slow"][0], (("payee", "x(y"),), None)
+        with patch("re.compile", side_effect=profiler.RuleTimeout):
+            self.assertEqual(budget.match(entry, SLOW_TRANSACTION), (False, {}))
+        self.assertTrue(entry[3] in budget.quarantined)
+        self.assertFalse("x(y" in tags._PATTERNS)  # not cached as invalid
+
+    def test_main(self):
+        argv = ["qifqif", "profile-rules", "-c", testdata.CFG_FILE]
+        with patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            self.assertEqual(qifqif.main(argv + [testdata.QIF_FILE]), 0)
+            self.assertEqual(qifqif.main(argv + ["-t", "0", testdata.QIF_FILE]), 1)
+        self.assertTrue("[SLOW]" in stdout.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
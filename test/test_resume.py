@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""Units tests for resume.py"""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from qifqif import qifile, resume
+
+CONTENT = b"PFoo\nLBars\n^\nPBar\n^\n"
+
+
+class TestResume(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.qif = os.path.join(self.tmpdir, "a.qif")
+        self.cfg = os.path.join(self.tmpdir, "config.json")
+        for (path, content) in ((self.qif, CONTENT), (self.cfg, b"{}")):
+            with io.open(path, "wb") as fout:
+                fout.write(content)
+        resume.save(self.qif, 1, self.cfg)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def skip(self):
+        with io.open(self.qif, "rb") as fin:
+            return resume.skip(self.qif, fin, self.cfg) + (fin.tell(),)
+
+    def test_skip(self):
+        self.assertEqual(self.skip(), (1, u"PFoo\nLBars\n^\n", 13))
+
+    def test_skip__config_changed(self):
+        with io.open(self.cfg, "wb") as fout:
+            fout.write(b'{"Bars": ["Foo"]}')
+        self.assertEqual(self.skip(), (0, u"", 0))
+
+    def test_skip__file_changed(self):
+        with io.open(self.qif, "wb") as fout:
+            fout.write(CONTENT.replace(b"Bars", b"Cars"))
+        self.assertEqual(self.skip(), (0, u"", 0))
+
+    def test_skip__other_output(self):
+        out = os.path.join(self.tmpdir, "out.qif")
+        with io.open(out, "wb") as fout:
+            fout.write(CONTENT.replace(b"PBar", b"PBar\nLCars"))
+        resume.save(out, 1, self.cfg, self.qif, 13)
+        with io.open(self.qif, "rb") as fin:
+            res = resume.skip(self.qif, fin, self.cfg, out) + (fin.tell(),)
+        self.assertEqual(res, (1, u"PFoo\nLBars\n^\n", 13))
+        with io.open(self.qif, "wb") as fout:  # input changed
+            fout.write(CONTENT.replace(b"PFoo", b"PFuu"))
+        with io.open(self.qif, "rb") as fin:
+            res = resume.skip(self.qif, fin, self.cfg, out) + (fin.tell(),)
+        self.assertEqual(res, (0, u"", 0))
+
+    def check_skip_output(self, content, count, expected):
+        """Interrupt processing of content to another file after count
+        transactions, then check payees of the ones left once resumed.
+        """
+        out = os.path.join(self.tmpdir, "out.qif")
+        with io.open(self.qif, "wb") as fout:
+            fout.write(content)
+        with io.open(self.qif, "rb") as fin:
+            reader = resume.LineReader(fin)
+            transactions = list(reader.track(qifile.iter_transactions(reader)))
+        with io.open(out, "w", encoding="utf-8") as fout:
+            qifile.write_transactions(transactions, fout)
+        resume.save(out, count, self.cfg, self.qif, reader.end_of(count))
+        with io.open(self.qif, "rb") as fin:
+            self.assertEqual(resume.skip(self.qif, fin, self.cfg, out)[0], count)
+            left = qifile.parse_lines(resume.LineReader(fin))
+        self.assertEqual([t["payee"] for t in left], expected)
+
+    def test_skip__other_output_empty_records(self):
+        content = b"PSully\n^\n^\nPFoo\n^\nPSully bar\n^\nPBaz\n^\n"
+        self.check_skip_output(content, 2, ["Sully bar", "Baz"])
+
+    def test_skip__other_output_indented_delimiters(self):
+        content = b"PA\n ^\nPB\n  ^\r\nPC\n ^\nPD\n ^\n"
+        self.check_skip_output(content, 1, ["B", "C", "D"])
+
+    def test_clear(self):
+        resume.clear(self.qif)
+        self.assertEqual(self.skip(), (0, u"", 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
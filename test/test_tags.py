@@ -5,11 +5,86 @@
 
 import unittest
 import copy
+import io
+import os
+import random
+import re
+import shutil
+import tempfile
 
-from qifqif import tags
+try:
+    from mock import patch  # py2
+except ImportError:
+    from unittest.mock import patch  # py3
+
+from qifqif import columnar, tags
 from testdata import TAGS, TRANSACTION
 
 OPTIONS = {"dry-run": True}
+WORDS = ["foo", "Bar", "spam", "EGGS", "caf\u00e9", "ma\u017f", "a.b", "x-y", "MAS"]
+WORDS += ["\u03b9x", "\u0345x"]  # case-insensitively equal, word and non-word
+
+
+def find_tag_for_reference(t):
+    """Straightforward implementation of tags.find_tag_for, one re.search per
+    rule, used to check rule engine optimizations.
+    """
+    res = []
+    for (tag, rulers) in list(tags.TAGS.items()):
+        for ruler in rulers:
+            matches = {}
+            for (field, rule) in tags.rulify(ruler).items():
+                try:
+                    m = re.search(rule, t[field.lower()], re.I)
+                    matches[field.lower()] = m.span() if m and m.group() else None
+                except Exception:
+                    matches[field.lower()] = None
+            if all(matches.values()):
+                res.append((tag, ruler, matches))
+    if not res:
+        return None, None, None
+    return max(
+        res,
+        key=lambda x: (
+            len(tags.rulify(x[1])),
+            sum([v[1] - v[0] for v in x[2].values() if v]),
+        ),
+    )
+
+
+def random_config(rng, words, size):
+    """Return random config mixing basic and guru rulers."""
+    res = {}
+    for i in range(size):
+        tag = "Tag%d" % rng.randint(0, size // 3)
+        kind = rng.random()
+        keyword = " ".join(rng.sample(words, rng.randint(1, 2)))
+        if kind < 0.6:
+            ruler = keyword
+        elif kind < 0.7:
+            ruler = {"payee": re.escape(keyword[:-1])}
+        elif kind < 0.8:
+            pattern = rng.choice(["%s.*%s", "(%s|%s)", "%s+%s?"])
+            pair = tuple(re.escape(x) for x in rng.sample(words, 2))
+            ruler = {"payee": pattern % pair}
+        elif kind < 0.95:
+            ruler = {"payee": keyword.split()[0], "memo": rng.choice(words)[1:]}
+        else:  # matches empty string
+            ruler = {"memo": rng.choice([".*", "x?"])}
+        res.setdefault(tag, []).append(ruler)
+    return res
+
+
+def random_transactions(rng, words, size):
+    res = []
+    for i in range(size):
+        res.append(
+            {
+                "payee": " ".join(rng.choice(words) for _ in range(4)),
+                "memo": rng.choice(words + ["", None]),
+            }
+        )
+    return res
 
 
 class TestTags(unittest.TestCase):
@@ -40,10 +115,121 @@ class TestTags(unittest.TestCase):
         tag, ruler, _ = tags.find_tag_for({"payee": "Sullyz Sull"})
         self.assertEqual(tag, None)
 
+    def test_find_tag_for__no_tags(self):
+        tags.TAGS = {}
+        self.assertEqual(tags.find_tag_for({"payee": "Sully"}), (None, None, None))
+
     def test_find_tag_for__best_ruler(self):
         tag, ruler, _ = tags.find_tag_for({"payee": "Foo Art Brut Shop"})
         self.assertEqual(tag, "Clothes")
 
+    def test_find_tag_for__invalid_regex(self):
+        tags.TAGS["Bars"].append({"payee": "(Sully"})
+        tag, ruler, _ = tags.find_tag_for({"payee": "(Sully"})
+        self.assertEqual(tag, "Bars")
+        self.assertEqual(ruler, "Sully")
+
+    def test_rule_error(self):
+        self.assertEqual(tags.rule_error(r"\bSully\b"), None)
+        self.assertTrue("missing )" in tags.rule_error("(Sully"))
+        self.assertEqual(tags.rule_error(12), "not a string")
+
+    def test_load__invalid_rules_reported(self):
+        tmpdir = tempfile.mkdtemp()
+        cfg = os.path.join(tmpdir, "config.json")
+        try:
+            rulers = ["Sully", {"payee": "(Sully", "memo": "x"}, "", 5, ["x"]]
+            tags.save(cfg, {"Bars": rulers})
+            for _ in range(2):  # from config, then from cache
+                with patch("sys.stderr", new_callable=io.StringIO) as stderr:
+                    tags.load(cfg)
+                self.assertTrue("payee rule missing )" in stderr.getvalue())
+                self.assertTrue('["x"]' in stderr.getvalue())
+                self.assertTrue("not a string or dict" in stderr.getvalue())
+                engine = tags.get_engine()
+                self.assertEqual(len(engine.invalid["Bars"]), 4)
+                self.assertEqual([x[2] for x in engine.entries], ["Sully"])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_ruler_literal(self):
+        rules = tags.compile_ruler({"payee": "Art.*Brut", "memo": r"(?-i:\bCHOUFFE)"})
+        self.assertEqual(tags.ruler_literal(rules), ("memo", "chouffe"))
+        rules = tags.compile_ruler({"payee": "(Sully|Abri) bar?"})
+        self.assertEqual(tags.ruler_literal(rules), ("payee", " ba"))
+        self.assertEqual(tags.ruler_literal(tags.compile_ruler({"payee": "a|b"})), None)
+
+    def test_compile_ruler(self):
+        rules = tags.compile_ruler({"PAYEE": "Sully", "amount": 12})
+        self.assertEqual(rules, (("payee", "Sully"), ("amount", None)))
+        self.assertTrue(tags.compile_rule("Sully") is tags.compile_rule("Sully"))
+
+    def test_find_tag_for__same_as_reference(self):
+        rng = random.Random(42)
+        for _ in range(20):
+            tags.TAGS = random_config(rng, WORDS, 30)
+            for t in random_transactions(rng, WORDS, 50):
+                self.assertEqual(tags.find_tag_for(t), find_tag_for_reference(t))
+
+    def test_match_columns__same_as_reference(self):
+        rng = random.Random(42)
+        for _ in range(20):
+            tags.TAGS = random_config(rng, WORDS, 30)
+            transactions = random_transactions(rng, WORDS, 50)
+            transactions.append({"payee": None, "memo": "foo"})
+            engine = tags.get_engine()
+            keys = [engine.cache_key(t) for t in transactions]
+            self.assertEqual(
+                columnar.match_columns(engine, keys),
+                [find_tag_for_reference(t) for t in transactions],
+            )
+
+    def test_prefetcher__stops_on_edit(self):
+        transactions = [{"payee": "Sully %d" % idx} for idx in range(10)]
+        res = columnar.ColumnarPrefetcher(transactions, chunk_size=4)
+        self.assertTrue(next(res) is transactions[0])
+        tags.edit({"payee": "Quizz"}, "Drinks", "Quizz", OPTIONS)
+        self.assertEqual(list(res), transactions[1:])
+        self.assertEqual(res.version, None)
+
+    def test_edit__same_as_reference(self):
+        rng = random.Random(42)
+        tags.TAGS = random_config(rng, WORDS, 30)
+        transactions = random_transactions(rng, WORDS, 50)
+        for t in random_transactions(rng, WORDS, 40):
+            ruler = rng.choice(list(random_config(rng, WORDS, 1).values()))[0]
+            tag = rng.choice(list(tags.TAGS) + ["New", None])
+            tags.edit(t, tag, ruler, OPTIONS)
+            for t in transactions:
+                self.assertEqual(tags.find_tag_for(t), find_tag_for_reference(t))
+        engine = tags.RuleEngine(tags.TAGS)
+        engine.build_index()
+        self.assertEqual(
+            [x[1:] for x in engine.entries], [x[1:] for x in tags.ENGINE.entries]
+        )
+
+    def test_find_tag_for__memoized(self):
+        t = {"payee": "Art Brut Shop", "memo": "foo"}
+        res = tags.find_tag_for(t)
+        self.assertTrue(tags.find_tag_for(dict(t, memo="bar")) is res)
+        tags.edit(t, "Shops", "Art Brut Shop", OPTIONS)
+        self.assertEqual(tags.find_tag_for(t)[0], "Shops")
+
+    def test_edit__noop(self):
+        tags.get_engine()
+        version = tags.VERSION
+        t = {"payee": "Unknown payee", "category": "Bars"}
+        self.assertEqual(tags.edit(t, "Bars", None, OPTIONS), None)
+        self.assertEqual(tags.VERSION, version)
+
+    @patch("qifqif.tags.MATCHES_CACHE_SIZE", 2)
+    def test_find_tag_for__memoized_lru(self):
+        payees = ("Art Brut Shop", "Sully", "Art Brut Shop", "Quizz")
+        for payee in payees:
+            tags.find_tag_for({"payee": payee})
+        keys = [key[tags.get_engine().fields.index("payee")] for key in tags._MATCHES]
+        self.assertEqual(keys, ["Art Brut Shop", "Quizz"])
+
     def test_convert(self):
         res = tags.convert({"foo": ["bar", {"memo": "rabbit"}], "bacon": ["spam"]})
         self.assertEqual(
@@ -60,6 +246,58 @@ class TestTags(unittest.TestCase):
         self.assertEqual(res["Bars"], ["Art Brut"])
         res = tags.edit(TRANSACTION, "Drinks", {"payee": "Sully"}, OPTIONS)
         self.assertEqual(res["Drinks"], [{"payee": "Sully"}])
+        tag, ruler, _ = tags.find_tag_for(TRANSACTION)
+        self.assertEqual((tag, ruler), ("Drinks", {"payee": "Sully"}))
+
+    def test_edit__deferred_save(self):
+        fd, cfg = tempfile.mkstemp()
+        os.close(fd)
+        options = {"config": cfg, "save-every": 2}
+        try:
+            tags.edit(TRANSACTION, "Drinks", "Sully bar", options)
+            self.assertEqual(os.path.getsize(cfg), 0)
+            tags.edit({"payee": "Docker"}, "Shoes", "Docker", options)
+            self.assertTrue("Shoes" in tags.load(cfg))
+            tags.edit({"payee": "Camper"}, "Shoes", "Camper", options)
+            tags.flush(cfg)
+            self.assertEqual(tags.load(cfg)["Shoes"], ["Docker", "Camper"])
+        finally:
+            os.unlink(cfg)
+
+    def test_save_if_due__interval(self):
+        fd, cfg = tempfile.mkstemp()
+        os.close(fd)
+        options = {"config": cfg, "save-every": 0, "save-interval": 60}
+        try:
+            with patch("time.time", return_value=tags._LAST_SAVE + 59):
+                tags.edit(TRANSACTION, "Drinks", "Sully bar", options)
+                tags.save_if_due(options)
+            self.assertEqual(os.path.getsize(cfg), 0)
+            with patch("time.time", return_value=tags._LAST_SAVE + 61):
+                tags.save_if_due(options)
+            self.assertTrue("Drinks" in tags.load(cfg))
+        finally:
+            os.unlink(cfg)
+
+    def test_load__cache(self):
+        tmpdir = tempfile.mkdtemp()
+        cfg = os.path.join(tmpdir, "config.json")
+        try:
+            tags.save(cfg, TAGS)
+            self.assertEqual(tags.load(cfg), TAGS)
+            self.assertTrue(tags.load_cache(cfg).tags == TAGS)
+            self.assertEqual(tags.load(cfg), TAGS)  # from cache
+            for t in random_transactions(random.Random(0), WORDS, 200):
+                self.assertEqual(tags.find_tag_for(t), find_tag_for_reference(t))
+            if hasattr(os, "getuid"):
+                with patch("os.getuid", return_value=os.getuid() + 1):
+                    self.assertEqual(tags.load_cache(cfg), None)  # not owned
+            tags.save(cfg, {"Drinks": ["Sully"]})
+            self.assertEqual(tags.load_cache(cfg), None)
+            self.assertEqual(tags.load(cfg), {"Drinks": ["Sully"]})
+            self.assertEqual(tags.find_tag_for({"payee": "Sully"})[0], "Drinks")
+        finally:
+            shutil.rmtree(tmpdir)
 
     def test_edit__drop_empty_category(self):
         t = TRANSACTION.copy()
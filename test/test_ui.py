@@ -4,7 +4,17 @@
 
 import unittest
 
-from qifqif import ui
+try:
+    from mock import patch  # py2
+except ImportError:
+    from unittest.mock import patch  # py3
+
+from qifqif import tags, ui
+
+
+class FakeTerm(object):
+    def green(self, text):
+        return "<%s>" % text
 
 
 class TestUi(unittest.TestCase):
@@ -13,6 +23,27 @@ class TestUi(unittest.TestCase):
             set(ui.complete_matches("A: B,C")), set(['A:', 'B,C', 'A: B,C'])
         )
 
+    def test_completer__contiguous_words(self):
+        self.assertEqual(
+            ui.complete_matches("foo bar  foo bar"),
+            ["foo", "bar", "foo bar"],
+        )
+
+    def test_completer__long_payee(self):
+        payee = " ".join("w%d" % idx for idx in range(200))
+        self.assertEqual(len(ui.complete_matches(payee, limit=300)), 300)
+        self.assertEqual(len(ui.complete_matches(" ".join(payee.split()[:30]))), 465)
+
+    @patch("qifqif.ui.TERM", FakeTerm())
+    def test_colorize_match(self):
+        t = {"payee": "Sully Bar", "memo": "chouffe"}
+        _, matches = tags.match({"payee": "bar", "memo": "ouf"}, t)
+        self.assertEqual(matches, {"payee": (6, 9), "memo": (2, 5)})
+        with patch("sys.stdout.isatty", return_value=True):
+            self.assertEqual(ui.colorize_match(t, "payee", matches), "Sully <Bar>")
+        with patch("sys.stdout.isatty", return_value=False):
+            self.assertEqual(ui.colorize_match(t, "payee", matches), "Sully Bar")
+
 
 if __name__ == "__main__":
     unittest.main()